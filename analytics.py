@@ -0,0 +1,290 @@
+"""Item analysis of a set's questions from its graded exams.
+
+Each exam stores its own option permutation of the question snapshots it was
+built from, so a student's shuffled answer is mapped back to the current
+``Question.option_*`` key by option text. The
+answers of all exams in a set form a response matrix (exams x questions) of
+original keys, from which difficulty, discrimination and distractor pick rates
+are computed with NumPy.
+"""
+import json
+import threading
+from itertools import chain
+
+import numpy as np
+
+from models import db, Exam, ExamAnswer, Question, QuestionVersion
+from papers import expand_paper, load_snapshots
+
+KEYS = 'abcd'
+NOT_SHOWN = -2  # question was not on this exam's paper (or can no longer be mapped)
+UNANSWERED = -1
+
+# One row per question on the compact papers of the given exams: the
+# question, its snapshot and the snapshot option the student chose (0-3, or
+# -1 when unanswered). The shown key is mapped back through the paper's
+# permutation as in app._GRADE_SQL.
+_CELLS_SQL = '''
+    SELECT e.id, v.question_id, v.id,
+        CASE WHEN a.chosen IN ('a', 'b', 'c', 'd')
+            THEN instr('abcd', substr(json_extract(p.value, '$[1]'), instr('abcd', a.chosen), 1)) - 1
+            ELSE -1 END
+    FROM exam e
+    JOIN json_each(e.questions_data, '$.q') p
+    JOIN question_version v ON v.id = json_extract(p.value, '$[0]')
+    LEFT JOIN exam_answer a ON a.exam_id = e.id AND a.question_id = v.question_id
+    WHERE e.id IN (SELECT value FROM json_each(:exam_ids))
+'''
+
+
+class _SetMatrix:
+    """Response matrix of one set, kept up to date as exams are graded and questions edited.
+
+    ``choices`` holds the text of every chosen option, as a code into
+    ``texts``, for each question that was ever on one of the set's papers.
+    ``responses`` maps it to the original keys of the current questions, so a
+    question edit only re-maps that question's column.
+    """
+
+    def __init__(self, set_id):
+        self.set_id = set_id
+        self.lock = threading.Lock()
+        self.version = None
+        self.texts = {}  # option text -> code used in choices
+        self.choice_column = {}  # question id -> column of choices
+        self.choices = np.full((0, 0), NOT_SHOWN, dtype=np.int32)
+        self.exam_ids = np.zeros(0, dtype=np.int64)  # exam of each row
+        self.size = 0
+        self.questions = []
+        self.options = []
+        self.correct = np.zeros(0, dtype=np.int8)
+        self.responses = np.full((0, 0), NOT_SHOWN, dtype=np.int8)
+
+    def _code(self, text):
+        return self.texts.setdefault(text, len(self.texts))
+
+    def _choice_columns(self, question_ids):
+        """Add ``choices`` columns for questions that have none yet."""
+        new = [qid for qid in dict.fromkeys(question_ids) if qid not in self.choice_column]
+        if not new:
+            return
+        for qid in new:
+            self.choice_column[qid] = len(self.choice_column)
+        grown = np.full((len(self.choices), len(self.choice_column)), NOT_SHOWN, dtype=np.int32)
+        grown[:, :self.choices.shape[1]] = self.choices
+        self.choices = grown
+
+    def _map(self, j, rows):
+        """Original keys of the current question ``j`` for the given rows of ``choices``."""
+        lookup = np.full(len(self.texts) + 2, NOT_SHOWN, dtype=np.int8)
+        lookup[UNANSWERED + 2] = UNANSWERED
+        for k, text in enumerate(self.options[j]):
+            lookup[self.texts[text] + 2] = k
+        return lookup[rows[:, self.choice_column[self.questions[j][0]]] + 2]
+
+    def sync(self, version):
+        """Load the set's questions if ``version`` changed, re-mapping only edited columns."""
+        if version == self.version:
+            return
+        rows = db.session.query(
+            Question.id, Question.text, Question.option_a, Question.option_b,
+            Question.option_c, Question.option_d, Question.correct,
+        ).filter(Question.question_set_id == self.set_id).order_by(Question.id).all()
+        previous = {qid: (j, options) for j, ((qid, _), options) in enumerate(zip(self.questions, self.options))}
+        self.questions = [(qid, text) for qid, text, *_ in rows]
+        self.options = [tuple(options) for _, _, *options, _ in rows]
+        self.correct = np.array([KEYS.index(r[-1]) for r in rows], dtype=np.int8)
+        for options in self.options:
+            for text in options:
+                self._code(text)
+        self._choice_columns(qid for qid, _ in self.questions)
+        responses = np.full((len(self.choices), len(rows)), NOT_SHOWN, dtype=np.int8)
+        for j, ((qid, _), options) in enumerate(zip(self.questions, self.options)):
+            old_j, old_options = previous.get(qid, (None, None))
+            if old_options == options:
+                responses[:self.size, j] = self.responses[:self.size, old_j]
+            else:
+                responses[:self.size, j] = self._map(j, self.choices[:self.size])
+        self.responses = responses
+        self.version = version
+
+    def refresh(self):
+        """Add exams graded since the last refresh and drop exams that are gone.
+
+        Progress is the set of exam ids already read, not a timestamp, so an
+        exam committed after others that finished later is still picked up.
+        Returns how many exams were added.
+        """
+        finished = {
+            exam_id for (exam_id,) in db.session.query(Exam.id).filter(
+                Exam.question_set_id == self.set_id, Exam.finished_at.isnot(None),
+            )
+        }
+        known = self.exam_ids[:self.size]
+        gone = ~np.isin(known, list(finished))
+        if gone.any():
+            self._keep(~gone)
+        new_ids = finished.difference(known.tolist())
+        if not new_ids:
+            return 0
+        # Exams that still have a full-copy paper or answers_data, from before
+        # papers.py and ExamAnswer, are read one by one.
+        legacy = {
+            exam_id for (exam_id,) in db.session.query(Exam.id).filter(
+                Exam.question_set_id == self.set_id, Exam.finished_at.isnot(None),
+                Exam.answers_data.isnot(None) | ~Exam.questions_data.startswith('{'),
+            )
+        }
+        snapshots = load_snapshots(QuestionVersion.question_set_id == self.set_id)
+        self._read(sorted(new_ids - legacy), snapshots)
+        legacy_ids = sorted(new_ids & legacy)
+        for start in range(0, len(legacy_ids), 500):
+            self._read_legacy(legacy_ids[start:start + 500], snapshots)
+        return len(new_ids)
+
+    def _read(self, exam_ids, snapshots):
+        """Add exams with compact papers, reading all their cells in one query."""
+        if not exam_ids:
+            return
+        # A DBAPI cursor yields plain tuples, several times cheaper than Row objects here
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.execute(_CELLS_SQL, {'exam_ids': json.dumps(exam_ids)})
+            cells = np.fromiter(chain.from_iterable(cursor), dtype=np.int64).reshape(-1, 4)
+        finally:
+            cursor.close()
+        exam_col, question_col, version_col, key_col = cells.T
+        exam_ids = np.array(exam_ids, dtype=np.int64)
+
+        question_ids, question_index = np.unique(question_col, return_inverse=True)
+        self._choice_columns(question_ids.tolist())
+        columns = np.array([self.choice_column[qid] for qid in question_ids.tolist()], dtype=np.intp)
+        version_ids, version_index = np.unique(version_col, return_inverse=True)
+        # Code of each snapshot option; the last column stands for unanswered
+        codes = np.full((len(version_ids), 5), UNANSWERED, dtype=np.int32)
+        for i, version_id in enumerate(version_ids.tolist()):
+            codes[i, :4] = [self._code(option) for option in snapshots[version_id][2:6]]
+
+        block = np.full((len(exam_ids), len(self.choice_column)), NOT_SHOWN, dtype=np.int32)
+        block[np.searchsorted(exam_ids, exam_col), columns[question_index]] = codes[version_index, key_col]
+        mapped = np.empty((len(exam_ids), len(self.questions)), dtype=np.int8)
+        for j in range(len(self.questions)):
+            mapped[:, j] = self._map(j, block)
+        self._append(exam_ids, block, mapped)
+
+    def _read_legacy(self, exam_ids, snapshots):
+        """Add exams cell by cell, decoding their papers and answers in Python."""
+        exams = db.session.query(Exam.id, Exam.questions_data, Exam.answers_data).filter(
+            Exam.id.in_(exam_ids),
+        ).all()
+        answers = {e.id: json.loads(e.answers_data) if e.answers_data else {} for e in exams}
+        for exam_id, qid, chosen in db.session.query(
+            ExamAnswer.exam_id, ExamAnswer.question_id, ExamAnswer.chosen,
+        ).filter(ExamAnswer.exam_id.in_(exam_ids)):
+            answers[exam_id][str(qid)] = chosen
+
+        cells = []
+        for exam in exams:
+            exam_answers = answers[exam.id]
+            row = []
+            for q in expand_paper(exam.questions_data, snapshots):
+                chosen = exam_answers.get(str(q['id']))
+                if chosen not in ('a', 'b', 'c', 'd'):
+                    row.append((q['id'], UNANSWERED))
+                else:
+                    row.append((q['id'], self._code(q[f'option_{chosen}'])))
+            cells.append(row)
+        self._choice_columns(qid for row in cells for qid, _ in row)
+        block = np.full((len(exams), len(self.choice_column)), NOT_SHOWN, dtype=np.int32)
+        for i, row in enumerate(cells):
+            for qid, code in row:
+                block[i, self.choice_column[qid]] = code
+        mapped = np.empty((len(exams), len(self.questions)), dtype=np.int8)
+        for j in range(len(self.questions)):
+            mapped[:, j] = self._map(j, block)
+        self._append(np.array([e.id for e in exams], dtype=np.int64), block, mapped)
+
+    def _append(self, exam_ids, choices, responses):
+        needed = self.size + len(exam_ids)
+        if needed > len(self.exam_ids):
+            capacity = max(needed, 2 * len(self.exam_ids))
+            self.exam_ids = np.resize(self.exam_ids, capacity)
+            for name, fill in (('choices', NOT_SHOWN), ('responses', NOT_SHOWN)):
+                old = getattr(self, name)
+                grown = np.full((capacity, old.shape[1]), fill, dtype=old.dtype)
+                grown[:self.size] = old[:self.size]
+                setattr(self, name, grown)
+        self.exam_ids[self.size:needed] = exam_ids
+        self.choices[self.size:needed] = choices
+        self.responses[self.size:needed] = responses
+        self.size = needed
+
+    def _keep(self, mask):
+        """Keep only the rows selected by ``mask``, e.g. after exams were archived."""
+        kept = int(mask.sum())
+        for name in ('exam_ids', 'choices', 'responses'):
+            array = getattr(self, name)
+            array[:kept] = array[:self.size][mask]
+        self.size = kept
+
+    def compute(self):
+        """Per-question statistics as a list of dicts, in question id order."""
+        r = self.responses[:self.size]
+        shown = r != NOT_SHOWN
+        m = shown.astype(np.float64)
+        x = (r == self.correct[None, :]).astype(np.float64)
+        n = m.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            difficulty = x.sum(axis=0) / n
+            # Point-biserial between the item and the rest of the paper (score
+            # fraction without the item), over the exams that showed the item.
+            k = m.sum(axis=1, keepdims=True)
+            rest = (x.sum(axis=1, keepdims=True) - x) / np.maximum(k - 1, 1)
+            mean_x = (x * m).sum(axis=0) / n
+            mean_r = (rest * m).sum(axis=0) / n
+            dx = (x - mean_x) * m
+            dr = (rest - mean_r) * m
+            cov = (dx * dr).sum(axis=0)
+            discrimination = cov / np.sqrt((dx ** 2).sum(axis=0) * (dr ** 2).sum(axis=0))
+            picks = np.stack([((r == key) & shown).sum(axis=0) for key in range(4)]) / n
+            unanswered = ((r == UNANSWERED) & shown).sum(axis=0) / n
+
+        def num(value):
+            return None if np.isnan(value) else float(value)
+
+        return [
+            {
+                'id': qid,
+                'text': text,
+                'exams': int(n[j]),
+                'correct': KEYS[self.correct[j]],
+                'difficulty': num(difficulty[j]),
+                'discrimination': num(discrimination[j]),
+                'picks': {KEYS[key]: num(picks[key, j]) for key in range(4)},
+                'unanswered': num(unanswered[j]),
+            }
+            for j, (qid, text) in enumerate(self.questions)
+        ]
+
+
+class ItemAnalysisCache:
+    """Response matrices per set, refreshed incrementally as exams are graded and questions change."""
+
+    def __init__(self):
+        self._lock = threading.Lock()  # guards _sets; each matrix has its own lock
+        self._sets = {}
+
+    def analyse(self, question_set):
+        with self._lock:
+            matrix = self._sets.get(question_set.id)
+            if matrix is None:
+                matrix = self._sets[question_set.id] = _SetMatrix(question_set.id)
+        # Reading a set's exams can take a while; views of other sets go on meanwhile
+        with matrix.lock:
+            matrix.sync(question_set.version)
+            matrix.refresh()
+            return matrix.compute()
+
+    def discard(self, set_id):
+        with self._lock:
+            self._sets.pop(set_id, None)
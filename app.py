@@ -1,23 +1,63 @@
 import csv
+import heapq
 import io
 import json
 import random
+import zlib
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import partial, wraps
+from itertools import islice
+
+import click
 
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, flash, Response, abort,
+    session, flash, Response, abort, stream_with_context,
 )
+from sqlalchemy import bindparam, func, literal, text, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from analytics import ItemAnalysisCache
+from archive import archive_exams, next_exam_id, unpack_exam
+from autosave import AnswerBuffer
 from config import Config
-from models import db, QuestionSet, Question, Exam
+from examstate import ExamStateCache
+from export import export_responses
+from importer import IMPORTED, DUPLICATE, INVALID, ImportFormatError, import_questions
+from live import LiveHub
+from metrics import Metrics
+from models import (
+    db, QuestionSet, Question, QuestionVersion, Exam, ExamAnswer, ExamPaper, ArchivedExam,
+    SetStats, configure_sqlite, upgrade_schema,
+)
+from pagecache import PageCache
+from papers import (
+    compact_papers, decode_paper, encode_paper, is_compact, snapshot_question, snapshots,
+)
+from pool import QuestionPoolCache, PaperRefiller, claim_paper, count_papers, fill_papers
+from regrade import regrade
+from search import ensure_search_index, find_near_duplicates, search_filter
+from stats import rebuild_set_stats, record_grade
+from sweeper import DeadlineSweeper, sweep_expired
 
 app = Flask(__name__)
 app.config.from_object(Config)
 db.init_app(app)
+metrics = Metrics(app.config['METRICS_ENABLED'], app.config['SLOW_REQUEST_MS'])
 
 with app.app_context():
+    configure_sqlite(app)
+    metrics.instrument(app, db.engine)
     db.create_all()
+    upgrade_schema()
+    ensure_search_index()
+    if SetStats.query.first() is None and Exam.query.filter(Exam.finished_at.isnot(None)).first():
+        rebuild_set_stats()
+
+question_pool = QuestionPoolCache()
+item_analysis = ItemAnalysisCache()
+exam_states = ExamStateCache(app.config['EXAM_STATE_CACHE_SIZE'])
+result_pages = PageCache(app.config['RESULT_PAGE_CACHE_BYTES'])
 
 
 # ---------------------------------------------------------------------------
@@ -33,59 +73,351 @@ def teacher_required(f):
     return decorated
 
 
-def _shuffle_options(q_dict):
-    """Shuffle options for a question and update the correct answer key."""
-    options = [
-        ('a', q_dict['option_a']),
-        ('b', q_dict['option_b']),
-        ('c', q_dict['option_c']),
-        ('d', q_dict['option_d']),
-    ]
-    correct_text = q_dict[f'option_{q_dict["correct"]}']
-    random.shuffle(options)
+def _csv_response(filename, header, rows, batch_rows=500):
+    """Stream rows as a CSV download, gzip-compressed when ``?gzip=1`` is passed."""
+    compress = request.args.get('gzip') == '1'
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        for i, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if i % batch_rows == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    chunks = (chunk.encode('utf-8') for chunk in generate())
+    if compress:
+        chunks = _gzip_chunks(chunks)
+        filename += '.gz'
+    return Response(
+        stream_with_context(chunks),
+        mimetype='application/gzip' if compress else 'text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@metrics.timed('shuffle_options')
+def _shuffle_options(version_id):
+    """Shuffle the options of a question snapshot; returns its compact paper entry."""
     keys = ['a', 'b', 'c', 'd']
-    new_correct = 'a'
-    result = {'id': q_dict['id'], 'text': q_dict['text']}
-    for i, (_, text) in enumerate(options):
-        result[f'option_{keys[i]}'] = text
-        if text == correct_text:
-            new_correct = keys[i]
-    result['correct'] = new_correct
-    return result
-
-
-def _grade_exam(exam):
-    """Grade an exam and persist the results."""
-    questions = json.loads(exam.questions_data)
+    random.shuffle(keys)
+    return [version_id, ''.join(keys)]
+
+
+def _bump_set_version(set_id):
+    """Invalidate cached question pools for a set; committed by the caller."""
+    QuestionSet.query.filter_by(id=set_id).update(
+        {QuestionSet.version: QuestionSet.version + 1},
+    )
+
+
+def _build_paper(qs):
+    """Sample and shuffle a new paper for a set; returns questions_data JSON or None."""
+    all_questions = question_pool.get(qs)
+    count = min(app.config['EXAM_QUESTION_COUNT'], len(all_questions))
+    if count == 0:
+        return None
+    selected = random.sample(all_questions, count)
+    return encode_paper([_shuffle_options(version_id) for version_id in selected])
+
+
+def _claim_or_build_paper(qs):
+    """Take a prepared paper if the set has a pool, otherwise build one now."""
+    if qs.paper_pool_size:
+        questions_data = claim_paper(qs)
+        remaining = count_papers(qs)
+        if remaining < qs.paper_pool_size * app.config['PAPER_POOL_REFILL_BELOW']:
+            paper_refiller.request(qs.id)
+        if questions_data is not None:
+            return questions_data
+    return _build_paper(qs)
+
+
+paper_refiller = PaperRefiller(app, _build_paper)
+
+
+def _load_answers(exam):
+    """Return the exam's answers as {question id (str): chosen key}."""
     answers = json.loads(exam.answers_data) if exam.answers_data else {}
-    score = 0
-    for q in questions:
-        qid = str(q['id'])
-        if answers.get(qid) == q['correct']:
-            score += 1
-    total = len(questions)
-    exam.score = score
-    exam.total = total
-    exam.passed = (score / total) >= app.config['PASS_THRESHOLD'] if total > 0 else False
-    exam.finished_at = datetime.utcnow()
+    rows = db.session.query(ExamAnswer.question_id, ExamAnswer.chosen).filter_by(exam_id=exam.id)
+    answers.update((str(qid), chosen) for qid, chosen in rows)
+    if answer_buffer is not None:
+        answers.update((str(qid), chosen) for qid, chosen in answer_buffer.pending(exam.id).items())
+    return answers
+
+
+def _upsert_answers(exam_id, changes, overwrite=True):
+    """Write {question id: chosen key} answers for an exam; committed by the caller."""
+    if not changes:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(ExamAnswer)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['exam_id', 'question_id'],
+            set_={'chosen': stmt.excluded.chosen, 'updated_at': stmt.excluded.updated_at},
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['exam_id', 'question_id'])
+    db.session.execute(stmt, [
+        {'exam_id': exam_id, 'question_id': int(qid), 'chosen': chosen, 'updated_at': now}
+        for qid, chosen in changes.items()
+    ])
+
+
+# Writes a student's answers unless the exam has been graded; unchanged rows are left alone.
+_SAVE_SQL = text('''
+    INSERT INTO exam_answer (exam_id, question_id, chosen, updated_at)
+    SELECT :exam_id, CAST(a.key AS INTEGER), a.value, :now
+    FROM json_each(:answers) a
+    WHERE EXISTS (SELECT 1 FROM exam WHERE id = :exam_id AND finished_at IS NULL)
+    ON CONFLICT (exam_id, question_id) DO UPDATE
+        SET chosen = excluded.chosen, updated_at = excluded.updated_at
+        WHERE exam_answer.chosen != excluded.chosen
+''').bindparams(bindparam('now', type_=db.DateTime))
+
+
+# Records a save's sequence number; matches no row if the exam was graded or a newer save was applied.
+_CLAIM_SAVE_SQL = text('''
+    UPDATE exam SET save_seq = :seq
+    WHERE id = :exam_id AND finished_at IS NULL AND coalesce(save_seq, 0) < :seq
+''')
+
+
+def _form_answers(state):
+    """The valid answers posted for an exam, as {question id (str): chosen key}."""
+    return {
+        name[2:]: val for name, val in request.form.items()
+        if name[2:] in state.question_ids and name.startswith('q_') and val in ('a', 'b', 'c', 'd')
+    }
+
+
+def _save_answers(exam_id, answers):
+    """Persist posted answers; returns the number of rows written.
+
+    Only the write touches the database; a buffered save writes nothing yet.
+    Committed by the caller.
+    """
+    if not answers:
+        return 0
+    if answer_buffer is not None:
+        answer_buffer.put(exam_id, answers)
+        return 0
+    return db.session.execute(_SAVE_SQL, {
+        'exam_id': exam_id, 'answers': json.dumps(answers), 'now': datetime.utcnow(),
+    }).rowcount
+
+
+def _claim_save(exam_id, seq):
+    """Mark save ``seq`` as the exam's latest; False if it is stale or the exam is graded."""
+    if answer_buffer is not None:
+        return answer_buffer.claim(exam_id, seq)
+    return db.session.execute(_CLAIM_SAVE_SQL, {'exam_id': exam_id, 'seq': seq}).rowcount == 1
+
+
+answer_buffer = None
+if app.config['AUTOSAVE_WRITE_BEHIND']:
+    answer_buffer = AnswerBuffer(
+        app, _upsert_answers,
+        interval=app.config['AUTOSAVE_FLUSH_SECONDS'],
+        max_staleness=app.config['AUTOSAVE_MAX_STALENESS_SECONDS'],
+    )
+
+# Exams that run out of time are graded this long after their deadline, once
+# every worker's write-behind buffer has written their last answers.
+GRADE_GRACE = timedelta(seconds=answer_buffer.grace_seconds if answer_buffer is not None else 0)
+
+
+def _deadline(started_at):
+    return started_at + timedelta(minutes=app.config['EXAM_DURATION_MINUTES'])
+
+
+# Counts the questions on the paper and the stored answers matching their correct key.
+_GRADE_SQL = text('''
+    SELECT count(*), count(a.id)
+    FROM exam e
+    JOIN json_each(e.questions_data, '$.q') p
+    JOIN question_version v ON v.id = json_extract(p.value, '$[0]')
+    LEFT JOIN exam_answer a
+        ON a.exam_id = e.id
+        AND a.question_id = v.question_id
+        AND a.chosen = substr('abcd', instr(
+            json_extract(p.value, '$[1]'),
+            coalesce(json_extract(p.value, '$[2]'), v.correct)
+        ), 1)
+    WHERE e.id = :exam_id
+''')
+
+# The same for papers stored as full question copies, before papers.py.
+_GRADE_LEGACY_SQL = text('''
+    SELECT count(*), count(a.id)
+    FROM exam e
+    JOIN json_each(e.questions_data) q
+    LEFT JOIN exam_answer a
+        ON a.exam_id = e.id
+        AND a.question_id = json_extract(q.value, '$.id')
+        AND a.chosen = json_extract(q.value, '$.correct')
+    WHERE e.id = :exam_id
+''')
+
+
+@metrics.timed('grade_exam')
+def _grade_exam(exam, commit=True, event='expired'):
+    """Grade an exam and persist the results.
+
+    ``event`` is the live event published if this call graded the exam. With
+    ``commit=False`` nothing is published yet: the caller commits, then calls
+    the returned function (None if the exam had already been graded).
+    """
+    if answer_buffer is not None:
+        _upsert_answers(exam.id, answer_buffer.take(exam.id))
+    if exam.answers_data:
+        # Answers saved before ExamAnswer existed; newer rows take precedence.
+        _upsert_answers(exam.id, json.loads(exam.answers_data), overwrite=False)
+        exam.answers_data = None
+    grade_sql = _GRADE_SQL if is_compact(exam.questions_data) else _GRADE_LEGACY_SQL
+    total, score = db.session.execute(grade_sql, {'exam_id': exam.id}).one()
+    passed = (score / total) >= app.config['PASS_THRESHOLD'] if total > 0 else False
+    # Only the first grader of an exam may count it in SetStats.
+    graded = Exam.query.filter_by(id=exam.id, finished_at=None).update({
+        Exam.score: score,
+        Exam.total: total,
+        Exam.passed: passed,
+        Exam.finished_at: datetime.utcnow(),
+    })
+    if graded:
+        record_grade(exam.question_set_id, score, total, passed)
+    exam_states.discard(exam.id)
+    if not graded:
+        db.session.refresh(exam)
+    publish = partial(_publish_live, event, exam, score=score, total=total, passed=passed) if graded else None
+    if not commit:
+        return publish
     db.session.commit()
+    if publish:
+        publish()
+
+
+deadline_sweeper = DeadlineSweeper(app, _grade_exam, GRADE_GRACE)
+
+live_events = LiveHub(
+    app.config['LIVE_EVENTS_FILE'], app.config['LIVE_EVENTS_MAX_BYTES'],
+    max_streams=app.config['LIVE_MAX_STREAMS'],
+)
 
 
-def _get_active_exam(email, index, set_id):
-    """Find an active (unfinished, not expired) exam for this student in a given set."""
-    exam = Exam.query.filter_by(
-        student_email=email,
-        student_index=index,
-        question_set_id=set_id,
-        finished_at=None,
-    ).first()
+def _publish_live(event, exam, **fields):
+    """Send an event about an exam (or its cached ``ExamState``) to live dashboards."""
+    live_events.publish({
+        'type': event,
+        'set': exam.question_set_id if isinstance(exam, Exam) else exam.set_id,
+        'exam': exam.id if isinstance(exam, Exam) else exam.exam_id,
+        'email': exam.student_email,
+        'index': exam.student_index,
+        'at': datetime.utcnow().isoformat(timespec='seconds'),
+        **fields,
+    })
+
+
+@app.before_request
+def _start_background_jobs():
+    deadline_sweeper.start()
+
+
+def _start_exam(set_id, email, index):
+    """Insert the student's exam, or return the one they already have for the set.
+
+    The unique student index turns a double-click or a login on a second
+    worker into a conflict, which returns the existing row instead. The insert
+    opens the write transaction, left to the caller to commit or roll back.
+    Returns ``(id, started_at, finished_at, created)``; a created exam has no
+    paper yet.
+    """
+    stmt = sqlite_insert(Exam).values(
+        id=next_exam_id(), question_set_id=set_id, student_email=email, student_index=index, attempt=1,
+        started_at=datetime.utcnow(), questions_data='',
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['question_set_id', 'student_email', 'student_index', 'attempt'],
+        set_={'attempt': stmt.excluded.attempt},  # unchanged; makes RETURNING yield the existing row
+    ).returning(Exam.id, Exam.started_at, Exam.finished_at, Exam.questions_data == '')
+    return db.session.execute(stmt).one()
+
+
+def _render_finished_exam(exam_id, template):
+    exam = db.session.get(Exam, exam_id)
     if exam is None:
-        return None
-    deadline = exam.started_at + timedelta(minutes=app.config['EXAM_DURATION_MINUTES'])
-    if datetime.utcnow() > deadline:
-        _grade_exam(exam)
-        return None
-    return exam
+        return _render_archived_exam(exam_id, template)
+    state = exam_states.for_exam(exam)
+    return render_template(
+        template,
+        exam=exam,
+        questions=state.questions,
+        answers=_load_answers(exam),
+        question_set=state.question_set,
+    )
+
+
+def _render_archived_exam(exam_id, template):
+    exam = db.session.get(ArchivedExam, exam_id)
+    questions_data, answers = unpack_exam(exam.payload)
+    return render_template(
+        template,
+        exam=exam,
+        questions=decode_paper(questions_data),
+        answers=answers,
+        question_set=db.session.get(QuestionSet, exam.question_set_id),
+    )
+
+
+def _finished_exam_page(exam_id, template):
+    """Render a finished exam's page with validators, reusing earlier renders.
+
+    The page only changes when the exam is regraded, so the ETag and
+    Last-Modified come from the finish/regrade time alone and a matching
+    conditional request is answered with 304 before anything is loaded.
+    """
+    stamps = (
+        db.session.query(Exam.finished_at, Exam.regraded_at).filter_by(id=exam_id).first()
+        or db.session.query(ArchivedExam.finished_at, ArchivedExam.regraded_at).filter_by(id=exam_id).first()
+    )
+    if stamps is None or stamps.finished_at is None:
+        abort(404)
+    if session.get('_flashes'):
+        # Flashed messages are shown once, so this render can't be reused.
+        return _render_finished_exam(exam_id, template)
+    modified = stamps.regraded_at or stamps.finished_at
+    viewer = 'teacher' if session.get('is_teacher') else 'student'  # the nav differs
+    etag = f'exam-{exam_id}-{modified:%Y%m%d%H%M%S%f}-{viewer}'
+    response = Response(mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    response.make_conditional(request)
+    if response.status_code == 304:
+        return response
+    key = (template, etag)
+    html = result_pages.get(key)
+    if html is None:
+        html = _render_finished_exam(exam_id, template).encode()
+        result_pages.put(key, html)
+    response.set_data(html)
+    return response
 
 
 # ---------------------------------------------------------------------------
@@ -112,38 +444,37 @@ def set_login_post(set_uuid):
         flash('Please enter your email and student ID.', 'danger')
         return redirect(url_for('set_login', set_uuid=set_uuid))
 
-    # Check if student already finished an exam for this set
-    finished = Exam.query.filter(
-        Exam.student_email == email,
-        Exam.student_index == index,
-        Exam.question_set_id == qs.id,
-        Exam.finished_at.isnot(None),
-    ).first()
-    if finished:
-        flash('You have already taken this exam.', 'warning')
-        return redirect(url_for('result', exam_id=finished.id))
-
-    # Resume or create
-    exam = _get_active_exam(email, index, qs.id)
-    if exam is None:
-        all_questions = Question.query.filter_by(question_set_id=qs.id).all()
-        count = min(app.config['EXAM_QUESTION_COUNT'], len(all_questions))
-        if count == 0:
+    # Create, resume, or send back to the result, in one transaction
+    exam_id, started_at, finished_at, created = _start_exam(qs.id, email, index)
+    if created:
+        archived_id = db.session.query(ArchivedExam.id).filter_by(
+            question_set_id=qs.id, student_email=email, student_index=index,
+        ).order_by(ArchivedExam.id).limit(1).scalar()
+        if archived_id is not None:
+            db.session.rollback()
+            flash('You have already taken this exam.', 'warning')
+            return redirect(url_for('result', exam_id=archived_id))
+        questions_data = _claim_or_build_paper(qs)
+        if questions_data is None:
+            db.session.rollback()
             flash('No questions in this exam set. Please contact your instructor.', 'danger')
             return redirect(url_for('set_login', set_uuid=set_uuid))
-        selected = random.sample(all_questions, count)
-        shuffled = [_shuffle_options(q.to_dict()) for q in selected]
-        exam = Exam(
-            question_set_id=qs.id,
-            student_email=email,
-            student_index=index,
-            questions_data=json.dumps(shuffled, ensure_ascii=False),
-            answers_data=json.dumps({}),
-        )
-        db.session.add(exam)
+        Exam.query.filter_by(id=exam_id).update({Exam.questions_data: questions_data})
         db.session.commit()
-
-    session['exam_id'] = exam.id
+        state = exam_states.get(exam_id)
+        _publish_live('started', state, questions=len(state.questions))
+    elif finished_at is not None:
+        db.session.rollback()
+        flash('You have already taken this exam.', 'warning')
+        return redirect(url_for('result', exam_id=exam_id))
+    elif datetime.utcnow() > _deadline(started_at) + GRADE_GRACE:
+        _grade_exam(db.session.get(Exam, exam_id))
+        flash('Your time for this exam has run out.', 'warning')
+        return redirect(url_for('result', exam_id=exam_id))
+    else:
+        db.session.rollback()
+
+    session['exam_id'] = exam_id
     session['student_email'] = email
     return redirect(url_for('exam_page'))
 
@@ -160,45 +491,66 @@ def exam_page():
             return redirect(url_for('result', exam_id=exam.id))
         return redirect(url_for('index'))
 
-    deadline = exam.started_at + timedelta(minutes=app.config['EXAM_DURATION_MINUTES'])
+    deadline = _deadline(exam.started_at)
     now = datetime.utcnow()
-    if now > deadline:
+    if now > deadline + GRADE_GRACE:
         _grade_exam(exam)
         session.pop('exam_id', None)
         return redirect(url_for('result', exam_id=exam.id))
 
-    remaining_seconds = int((deadline - now).total_seconds())
-    questions = json.loads(exam.questions_data)
-    answers = json.loads(exam.answers_data) if exam.answers_data else {}
-    qs = db.session.get(QuestionSet, exam.question_set_id)
+    # Within the grace period the page submits itself right away
+    remaining_seconds = max(int((deadline - now).total_seconds()), 0)
+    state = exam_states.for_exam(exam)
+    answers = _load_answers(exam)
+    save_seq = answer_buffer.save_seq(exam.id) if answer_buffer is not None else exam.save_seq or 0
     return render_template(
         'exam.html',
-        questions=questions,
+        questions=state.questions,
         answers=answers,
         remaining=remaining_seconds,
+        save_seq=save_seq,
         exam_id=exam.id,
-        question_set=qs,
+        question_set=state.question_set,
     )
 
 
 @app.route('/exam/save', methods=['POST'])
 def exam_save():
-    """Save answers without submitting (called periodically by JS)."""
+    """Save changed answers without submitting (sent by exam.js after each change).
+
+    exam.js numbers its saves in ``seq``. A save older than the latest applied
+    one is rejected with 409 and the current number, so a slow request cannot
+    overwrite newer answers; the client resends what is still unsaved.
+    """
     exam_id = session.get('exam_id')
     if not exam_id:
         return {'ok': False}, 401
-    exam = db.session.get(Exam, exam_id)
-    if not exam or exam.finished_at:
+    state = exam_states.get(exam_id)
+    if state is None:
         return {'ok': False}, 400
 
-    answers = {}
-    questions = json.loads(exam.questions_data)
-    for q in questions:
-        val = request.form.get(f'q_{q["id"]}')
-        if val:
-            answers[str(q['id'])] = val
-    exam.answers_data = json.dumps(answers, ensure_ascii=False)
+    if answer_buffer is not None and datetime.utcnow() > _deadline(state.started_at):
+        # Buffered answers must reach the database before deadline grading
+        return {'ok': False}, 400
+    answers = _form_answers(state)
+    seq = request.form.get('seq', type=int)
+    if seq is not None and not _claim_save(exam_id, seq):
+        finished_at, save_seq = db.session.query(Exam.finished_at, Exam.save_seq).filter_by(id=exam_id).one()
+        if finished_at is not None:
+            exam_states.discard(exam_id)
+            return {'ok': False}, 400
+        if answer_buffer is not None:
+            save_seq = answer_buffer.save_seq(exam_id)
+        return {'ok': False, 'seq': save_seq or 0}, 409
+    written = _save_answers(exam_id, answers)
     db.session.commit()
+    if seq is None and not written and answer_buffer is None:
+        # Nothing changed, or the exam was graded since it was cached.
+        if db.session.query(Exam.finished_at).filter_by(id=exam_id).scalar() is not None:
+            exam_states.discard(exam_id)
+            return {'ok': False}, 400
+    answered = min(request.form.get('answered', len(answers), type=int), len(state.questions))
+    _publish_live('saved', state, answered=answered)
     return {'ok': True}
 
 
@@ -214,33 +566,15 @@ def exam_submit():
             return redirect(url_for('result', exam_id=exam.id))
         return redirect(url_for('index'))
 
-    answers = {}
-    questions = json.loads(exam.questions_data)
-    for q in questions:
-        val = request.form.get(f'q_{q["id"]}')
-        if val:
-            answers[str(q['id'])] = val
-    exam.answers_data = json.dumps(answers, ensure_ascii=False)
-    _grade_exam(exam)
+    _save_answers(exam.id, _form_answers(exam_states.for_exam(exam)))
+    _grade_exam(exam, event='submitted')
     session.pop('exam_id', None)
     return redirect(url_for('result', exam_id=exam.id))
 
 
 @app.route('/result/<int:exam_id>')
 def result(exam_id):
-    exam = db.session.get(Exam, exam_id)
-    if not exam or not exam.finished_at:
-        abort(404)
-    questions = json.loads(exam.questions_data)
-    answers = json.loads(exam.answers_data) if exam.answers_data else {}
-    qs = db.session.get(QuestionSet, exam.question_set_id)
-    return render_template(
-        'result.html',
-        exam=exam,
-        questions=questions,
-        answers=answers,
-        question_set=qs,
-    )
+    return _finished_exam_page(exam_id, 'result.html')
 
 
 # ---------------------------------------------------------------------------
@@ -268,14 +602,16 @@ def teacher_logout():
 @teacher_required
 def teacher_dashboard():
     total_questions = Question.query.count()
-    total_exams = Exam.query.filter(Exam.finished_at.isnot(None)).count()
-    passed = Exam.query.filter_by(passed=True).count()
-    failed = Exam.query.filter_by(passed=False).filter(Exam.finished_at.isnot(None)).count()
     total_sets = QuestionSet.query.count()
+    set_stats = db.session.query(SetStats, QuestionSet.name).join(
+        QuestionSet, QuestionSet.id == SetStats.question_set_id,
+    ).order_by(QuestionSet.name).all()
+    total_exams = sum(st.exams for st, _ in set_stats)
+    passed = sum(st.passed for st, _ in set_stats)
+    failed = sum(st.failed for st, _ in set_stats)
     avg_score = None
     if total_exams > 0:
-        exams = Exam.query.filter(Exam.finished_at.isnot(None)).all()
-        avg_score = sum(e.score for e in exams) / total_exams
+        avg_score = sum(st.score_sum for st, _ in set_stats) / total_exams
     return render_template(
         'teacher/dashboard.html',
         total_questions=total_questions,
@@ -284,9 +620,36 @@ def teacher_dashboard():
         failed=failed,
         avg_score=avg_score,
         total_sets=total_sets,
+        set_stats=set_stats,
     )
 
 
+@app.route('/teacher/stats')
+@teacher_required
+def teacher_stats():
+    """Per-process cache and autosave buffer counters, as JSON."""
+    stats = {
+        'question_pool': question_pool.stats(),
+        'question_snapshots': snapshots.stats(),
+        'exam_states': exam_states.stats(),
+        'result_pages': result_pages.stats(),
+        'live_events': live_events.stats(),
+        'deadline_sweeper': deadline_sweeper.stats(),
+    }
+    if answer_buffer is not None:
+        stats['autosave_buffer'] = answer_buffer.stats()
+    return stats
+
+
+@app.route('/teacher/metrics')
+@teacher_required
+def teacher_metrics():
+    """Request, SQL and section timings of this worker in Prometheus text format."""
+    if not metrics.enabled:
+        abort(404)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 # --- Question Sets ---
 
 @app.route('/teacher/sets', methods=['GET', 'POST'])
@@ -303,7 +666,34 @@ def teacher_sets():
             flash(f'Question set "{name}" created.', 'success')
         return redirect(url_for('teacher_sets'))
     sets = QuestionSet.query.order_by(QuestionSet.created_at.desc()).all()
-    return render_template('teacher/sets.html', sets=sets)
+    paper_counts = dict(
+        db.session.query(ExamPaper.question_set_id, func.count(ExamPaper.id))
+        .join(QuestionSet, QuestionSet.id == ExamPaper.question_set_id)
+        .filter(ExamPaper.set_version == QuestionSet.version)
+        .group_by(ExamPaper.question_set_id)
+        .all()
+    )
+    return render_template('teacher/sets.html', sets=sets, paper_counts=paper_counts)
+
+
+@app.route('/teacher/sets/<int:set_id>/prepare', methods=['POST'])
+@teacher_required
+def teacher_prepare_set(set_id):
+    """Pre-generate papers so student logins only have to claim one."""
+    qs = db.session.get(QuestionSet, set_id)
+    if not qs:
+        abort(404)
+    size = request.form.get('count', type=int)
+    if size is None or size < 0:
+        flash('Please enter the number of papers to prepare.', 'danger')
+        return redirect(url_for('teacher_sets'))
+    qs.paper_pool_size = size
+    added = fill_papers(qs, _build_paper)
+    if size:
+        flash(f'Prepared {added} papers for "{qs.name}".', 'success')
+    else:
+        flash(f'Paper pool disabled for "{qs.name}".', 'success')
+    return redirect(url_for('teacher_sets'))
 
 
 @app.route('/teacher/sets/<int:set_id>/delete', methods=['POST'])
@@ -312,7 +702,12 @@ def teacher_delete_set(set_id):
     qs = db.session.get(QuestionSet, set_id)
     if qs:
         db.session.delete(qs)
+        QuestionVersion.query.filter_by(question_set_id=set_id).delete()
+        ArchivedExam.query.filter_by(question_set_id=set_id).delete()
         db.session.commit()
+        question_pool.discard(set_id)
+        item_analysis.discard(set_id)
+        exam_states.discard_set(set_id)
         flash(f'Question set "{qs.name}" deleted.', 'success')
     return redirect(url_for('teacher_sets'))
 
@@ -356,7 +751,9 @@ def teacher_questions():
                     text=text, option_a=option_a, option_b=option_b,
                     option_c=option_c, option_d=option_d, correct=correct,
                 )
+                q.content_hash = q.compute_content_hash()
                 db.session.add(q)
+                _bump_set_version(current_set.id)
                 db.session.commit()
                 flash('Question added.', 'success')
 
@@ -366,38 +763,70 @@ def teacher_questions():
                 flash('Please upload a CSV file.', 'danger')
             else:
                 try:
-                    stream = io.TextIOWrapper(file.stream, encoding='utf-8')
-                    reader = csv.DictReader(stream)
-                    count = 0
-                    for row in reader:
-                        if not all(k in row for k in ('text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct')):
-                            continue
-                        if row['correct'].strip().lower() not in ('a', 'b', 'c', 'd'):
-                            continue
-                        q = Question(
-                            question_set_id=current_set.id,
-                            text=row['text'].strip(),
-                            option_a=row['option_a'].strip(),
-                            option_b=row['option_b'].strip(),
-                            option_c=row['option_c'].strip(),
-                            option_d=row['option_d'].strip(),
-                            correct=row['correct'].strip().lower(),
-                        )
-                        db.session.add(q)
-                        count += 1
+                    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+                    report = import_questions(current_set.id, stream)
+                    counts = {status: 0 for status in (IMPORTED, DUPLICATE, INVALID)}
+                    for entry in report:
+                        counts[entry.status] += 1
+                    if counts[IMPORTED]:
+                        _bump_set_version(current_set.id)
                     db.session.commit()
-                    flash(f'Imported {count} questions.', 'success')
-                except Exception as e:
+                    return render_template(
+                        'teacher/import_report.html',
+                        current_set=current_set,
+                        filename=file.filename,
+                        counts=counts,
+                        problems=[e for e in report if e.status != IMPORTED],
+                    )
+                except (ImportFormatError, UnicodeDecodeError, csv.Error) as e:
+                    db.session.rollback()
                     flash(f'Import error: {e}', 'danger')
 
         return redirect(url_for('teacher_questions', set=current_set.id))
 
-    questions = Question.query.filter_by(question_set_id=current_set.id).order_by(Question.id).all()
+    search = request.args.get('q', '').strip()
+    query = Question.query.filter(Question.question_set_id == current_set.id)
+    matching = search_filter(search)
+    if matching is not None:
+        query = query.filter(matching)
+    total = query.count()
+    after = request.args.get('after', type=int)
+    if after:
+        query = query.filter(Question.id > after)
+    page_size = app.config['QUESTIONS_PAGE_SIZE']
+    questions = query.order_by(Question.id).limit(page_size + 1).all()
+    next_cursor = None
+    if len(questions) > page_size:
+        questions = questions[:page_size]
+        next_cursor = questions[-1].id
     return render_template(
         'teacher/questions.html',
         questions=questions,
         sets=sets,
         current_set=current_set,
+        search=search,
+        total=total,
+        next_cursor=next_cursor,
+        is_first_page=not after,
+    )
+
+
+@app.route('/teacher/questions/duplicates')
+@teacher_required
+def teacher_question_duplicates():
+    qs = db.session.get(QuestionSet, request.args.get('set', type=int) or 0)
+    if not qs:
+        abort(404)
+    pairs = find_near_duplicates(qs.id)
+    shown = pairs[:500]
+    ids = {qid for pair in shown for qid in (pair.first, pair.second)}
+    questions = {q.id: q for q in Question.query.filter(Question.id.in_(ids))} if ids else {}
+    return render_template(
+        'teacher/duplicates.html',
+        current_set=qs,
+        pairs=shown,
+        pair_count=len(pairs),
+        questions=questions,
     )
 
 
@@ -405,19 +834,20 @@ def teacher_questions():
 @teacher_required
 def teacher_questions_csv():
     set_id = request.args.get('set', type=int)
-    query = Question.query
+    query = db.session.query(
+        Question.text, Question.option_a, Question.option_b,
+        Question.option_c, Question.option_d, Question.correct,
+    )
     if set_id:
-        query = query.filter_by(question_set_id=set_id)
-    questions = query.order_by(Question.id).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct'])
-    for q in questions:
-        writer.writerow([q.text, q.option_a, q.option_b, q.option_c, q.option_d, q.correct])
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=questions.csv'},
+        query = query.filter(Question.question_set_id == set_id)
+    matching = search_filter(request.args.get('q'))
+    if matching is not None:
+        query = query.filter(matching)
+    rows = query.order_by(Question.id).execution_options(yield_per=500)
+    return _csv_response(
+        'questions.csv',
+        ['text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct'],
+        rows,
     )
 
 
@@ -434,10 +864,17 @@ def teacher_edit_question(qid):
         q.option_c = request.form.get('option_c', '').strip()
         q.option_d = request.form.get('option_d', '').strip()
         correct = request.form.get('correct', '').strip().lower()
-        if correct in ('a', 'b', 'c', 'd'):
+        correct_changed = correct in ('a', 'b', 'c', 'd') and correct != q.correct
+        if correct_changed:
             q.correct = correct
+        q.content_hash = q.compute_content_hash()
+        snapshot_question(q)
+        _bump_set_version(q.question_set_id)
         db.session.commit()
         flash('Question updated.', 'success')
+        if correct_changed:
+            flash('The correct answer changed. Review how existing results would be regraded.', 'warning')
+            return redirect(url_for('teacher_regrade', set_id=q.question_set_id, question=q.id))
         return redirect(url_for('teacher_questions', set=q.question_set_id))
     return render_template('teacher/edit_question.html', question=q)
 
@@ -449,6 +886,7 @@ def teacher_delete_question(qid):
     set_id = q.question_set_id if q else None
     if q:
         db.session.delete(q)
+        _bump_set_version(set_id)
         db.session.commit()
         flash('Question deleted.', 'success')
     return redirect(url_for('teacher_questions', set=set_id))
@@ -456,60 +894,369 @@ def teacher_delete_question(qid):
 
 # --- Results ---
 
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def _results_filters():
+    """Read the results filters (set, status, email prefix, date range) from the query string."""
+    return {
+        'set': request.args.get('set', type=int),
+        'status': request.args.get('status') if request.args.get('status') in ('passed', 'failed') else None,
+        'email': request.args.get('email', '').strip().lower(),
+        'from': request.args.get('from', '') if _parse_date(request.args.get('from')) else '',
+        'to': request.args.get('to', '') if _parse_date(request.args.get('to')) else '',
+    }
+
+
+def _filter_results(query, filters, model=Exam):
+    """Restrict a query on finished exams (``Exam`` or ``ArchivedExam``) to the results filters."""
+    query = query.filter(model.finished_at.isnot(None))
+    if filters['set']:
+        query = query.filter(model.question_set_id == filters['set'])
+    if filters['status']:
+        query = query.filter(model.passed.is_(filters['status'] == 'passed'))
+    if filters['email']:
+        query = query.filter(model.student_email.startswith(filters['email'], autoescape=True))
+    if filters['from']:
+        query = query.filter(model.finished_at >= _parse_date(filters['from']))
+    if filters['to']:
+        query = query.filter(model.finished_at < _parse_date(filters['to']) + timedelta(days=1))
+    return query
+
+
+def _finished_exams(filters, columns, cursor=None, limit=None, yield_per=None):
+    """Rows of matching live and archived exams, newest first.
+
+    ``columns`` maps a model to the columns to select from it; every row must
+    end with ``finished_at`` and ``id``, which order both queries. Each query
+    uses its own index and the two ordered streams are merged.
+    """
+    streams = []
+    for model in (Exam, ArchivedExam):
+        query = db.session.query(*columns(model)).outerjoin(
+            QuestionSet, QuestionSet.id == model.question_set_id,
+        )
+        query = _filter_results(query, filters, model)
+        if cursor:
+            query = query.filter(tuple_(model.finished_at, model.id) < tuple_(*cursor))
+        query = query.order_by(model.finished_at.desc(), model.id.desc())
+        if limit:
+            query = query.limit(limit)
+        if yield_per:
+            query = query.execution_options(yield_per=yield_per)
+        streams.append(query)
+    return heapq.merge(*streams, key=lambda row: (row[-2], row[-1]), reverse=True)
+
+
+def _parse_cursor(value):
+    """Decode an ``after`` cursor of the form ``<finished_at ISO>,<exam id>``."""
+    try:
+        finished_at, exam_id = value.rsplit(',', 1)
+        return datetime.fromisoformat(finished_at), int(exam_id)
+    except (AttributeError, ValueError):
+        return None
+
+
 @app.route('/teacher/results')
 @teacher_required
 def teacher_results():
-    set_id = request.args.get('set', type=int)
     sets = QuestionSet.query.order_by(QuestionSet.name).all()
-    query = Exam.query.filter(Exam.finished_at.isnot(None))
-    if set_id:
-        query = query.filter_by(question_set_id=set_id)
-    exams = query.order_by(Exam.finished_at.desc()).all()
-    return render_template('teacher/results.html', exams=exams, sets=sets, current_set_id=set_id)
+    filters = _results_filters()
+    page_size = app.config['RESULTS_PAGE_SIZE']
+    cursor = _parse_cursor(request.args.get('after'))
+    rows = list(islice(_finished_exams(filters, lambda model: (
+        model.student_email, model.student_index, model.score, model.total, model.passed,
+        QuestionSet.name.label('set_name'), literal(model is ArchivedExam).label('archived'),
+        model.finished_at, model.id,
+    ), cursor=cursor, limit=page_size + 1), page_size + 1))
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = f'{rows[-1].finished_at.isoformat()},{rows[-1].id}'
+    return render_template(
+        'teacher/results.html',
+        exams=rows,
+        sets=sets,
+        filters=filters,
+        filter_args={k: v for k, v in filters.items() if v},
+        current_set_id=filters['set'],
+        next_cursor=next_cursor,
+        is_first_page=cursor is None,
+    )
 
 
 @app.route('/teacher/results/<int:exam_id>')
 @teacher_required
 def teacher_result_detail(exam_id):
-    exam = db.session.get(Exam, exam_id)
-    if not exam or not exam.finished_at:
+    return _finished_exam_page(exam_id, 'teacher/result_detail.html')
+
+
+@app.route('/teacher/results/csv')
+@teacher_required
+def teacher_results_csv():
+    exams = _finished_exams(_results_filters(), lambda model: (
+        QuestionSet.name, model.student_email, model.student_index, model.score, model.total,
+        model.passed, model.started_at, model.finished_at, model.id,
+    ), yield_per=500)
+
+    def rows():
+        for set_name, email, index, score, total, passed, started_at, finished_at, _ in exams:
+            pct = round(score / total * 100, 1) if total else 0
+            yield [
+                set_name or '', email, index, score, total,
+                f'{pct}%', 'YES' if passed else 'NO',
+                started_at.strftime('%Y-%m-%d %H:%M'), finished_at.strftime('%Y-%m-%d %H:%M'),
+            ]
+
+    return _csv_response(
+        'results.csv',
+        ['set', 'email', 'index', 'score', 'total', 'percentage', 'passed', 'started_at', 'finished_at'],
+        rows(),
+    )
+
+
+@app.route('/teacher/results/answers.csv')
+@teacher_required
+def teacher_answers_csv():
+    """One row per answered (or skipped) question of every matching finished exam."""
+    exams = _finished_exams(_results_filters(), lambda model: (
+        QuestionSet.name.label('set_name'), model.student_email, model.student_index,
+        # Archived exams carry paper and answers in their payload
+        (ArchivedExam.payload if model is ArchivedExam else Exam.questions_data).label('data'),
+        (literal(None) if model is ArchivedExam else Exam.answers_data).label('answers_data'),
+        literal(model is ArchivedExam).label('archived'), model.finished_at, model.id,
+    ), yield_per=200)
+
+    def rows():
+        while partition := list(islice(exams, 200)):
+            papers, answers = {}, {}
+            for row in partition:
+                if row.archived:
+                    papers[row.id], answers[row.id] = unpack_exam(row.data)
+                else:
+                    papers[row.id] = row.data
+                    answers[row.id] = json.loads(row.answers_data) if row.answers_data else {}
+            for exam_id, qid, chosen in db.session.query(
+                ExamAnswer.exam_id, ExamAnswer.question_id, ExamAnswer.chosen,
+            ).filter(ExamAnswer.exam_id.in_([row.id for row in partition if not row.archived])):
+                answers[exam_id][str(qid)] = chosen
+            for row in partition:
+                for q in decode_paper(papers[row.id]):
+                    chosen = answers[row.id].get(str(q['id']))
+                    yield [
+                        row.id, row.set_name or '', row.student_email, row.student_index, q['id'], q['text'],
+                        chosen or '', q[f'option_{chosen}'] if chosen else '',
+                        q['correct'], q[f'option_{q["correct"]}'],
+                        'YES' if chosen == q['correct'] else 'NO',
+                    ]
+
+    return _csv_response(
+        'answers.csv',
+        ['exam_id', 'set', 'email', 'index', 'question_id', 'question', 'chosen', 'chosen_text',
+         'correct', 'correct_text', 'is_correct'],
+        rows(),
+    )
+
+
+# --- Regrade ---
+
+def _regrade(set_id, question_id, dry_run, parallel=True):
+    return regrade(
+        set_id,
+        question_ids=[question_id] if question_id else None,
+        dry_run=dry_run,
+        pass_threshold=app.config['PASS_THRESHOLD'],
+        workers=app.config['REGRADE_WORKERS'] if parallel else 1,
+        parallel_min_exams=app.config['REGRADE_PARALLEL_MIN_EXAMS'],
+    )
+
+
+@app.route('/teacher/sets/<int:set_id>/regrade', methods=['GET', 'POST'])
+@teacher_required
+def teacher_regrade(set_id):
+    """Show (GET) or apply (POST) a regrade of a set, or of one question with ?question=."""
+    qs = db.session.get(QuestionSet, set_id)
+    if not qs:
         abort(404)
-    questions = json.loads(exam.questions_data)
-    answers = json.loads(exam.answers_data) if exam.answers_data else {}
-    qs = db.session.get(QuestionSet, exam.question_set_id)
+    question = None
+    question_id = request.args.get('question', type=int)
+    if question_id:
+        question = db.session.get(Question, question_id)
+        if not question or question.question_set_id != set_id:
+            abort(404)
+    applied = request.method == 'POST'
+    # The preview never starts a process pool inside a page view
+    diffs, checked, unmatched, archived = _regrade(set_id, question_id, dry_run=not applied, parallel=applied)
+    if applied:
+        flash(f'Regraded {len(diffs)} of {checked} exams.', 'success')
     return render_template(
-        'teacher/result_detail.html',
-        exam=exam,
-        questions=questions,
-        answers=answers,
+        'teacher/regrade.html',
         question_set=qs,
+        question=question,
+        diffs=diffs,
+        checked=checked,
+        unmatched=unmatched,
+        archived=archived,
+        applied=applied,
     )
 
 
-@app.route('/teacher/results/csv')
+# --- Item analysis ---
+
+@app.route('/teacher/analysis')
 @teacher_required
-def teacher_results_csv():
+def teacher_analysis():
+    sets = QuestionSet.query.order_by(QuestionSet.name).all()
+    if not sets:
+        flash('Create a question set first.', 'warning')
+        return redirect(url_for('teacher_sets'))
     set_id = request.args.get('set', type=int)
-    query = Exam.query.filter(Exam.finished_at.isnot(None))
-    if set_id:
-        query = query.filter_by(question_set_id=set_id)
-    exams = query.order_by(Exam.finished_at.desc()).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['set', 'email', 'index', 'score', 'total', 'percentage', 'passed', 'started_at', 'finished_at'])
-    for e in exams:
-        pct = round(e.score / e.total * 100, 1) if e.total else 0
-        set_name = e.question_set.name if e.question_set else ''
-        writer.writerow([
-            set_name, e.student_email, e.student_index, e.score, e.total,
-            f'{pct}%', 'YES' if e.passed else 'NO',
-            e.started_at.strftime('%Y-%m-%d %H:%M'), e.finished_at.strftime('%Y-%m-%d %H:%M'),
-        ])
-    return Response(
-        output.getvalue(),
-        mimetype='text/csv',
-        headers={'Content-Disposition': 'attachment; filename=results.csv'},
+    current_set = db.session.get(QuestionSet, set_id) if set_id else None
+    if not current_set:
+        current_set = sets[0]
+    items = item_analysis.analyse(current_set)
+    return render_template(
+        'teacher/analysis.html',
+        items=items,
+        sets=sets,
+        current_set=current_set,
+    )
+
+
+# --- Live proctoring ---
+
+@app.route('/teacher/live')
+@teacher_required
+def teacher_live():
+    """Exams in progress for a set, kept up to date by the event stream."""
+    sets = QuestionSet.query.order_by(QuestionSet.name).all()
+    if not sets:
+        flash('Create a question set first.', 'warning')
+        return redirect(url_for('teacher_sets'))
+    set_id = request.args.get('set', type=int)
+    current_set = db.session.get(QuestionSet, set_id) if set_id else None
+    if not current_set:
+        current_set = sets[0]
+    cutoff = datetime.utcnow() - timedelta(minutes=app.config['EXAM_DURATION_MINUTES'])
+    answered = db.session.query(func.count(ExamAnswer.id)).filter(
+        ExamAnswer.exam_id == Exam.id,
+    ).scalar_subquery()
+    question_count = func.coalesce(
+        func.json_array_length(Exam.questions_data, '$.q'), func.json_array_length(Exam.questions_data),
+    )
+    exams = db.session.query(
+        Exam.id, Exam.student_email, Exam.student_index, Exam.started_at,
+        question_count.label('questions'), answered.label('answered'),
+    ).filter(
+        Exam.question_set_id == current_set.id,
+        Exam.finished_at.is_(None),
+        Exam.started_at >= cutoff,
+    ).order_by(Exam.started_at).all()
+    return render_template(
+        'teacher/live.html',
+        exams=exams,
+        sets=sets,
+        current_set=current_set,
+    )
+
+
+@app.route('/teacher/live/stream')
+@teacher_required
+def teacher_live_stream():
+    """Server-Sent Events for the live page; one open connection per viewer.
+
+    A stream holds a worker thread while it is open, so each worker serves at
+    most ``LIVE_MAX_STREAMS`` and refuses more with 503; live.js retries later.
+    """
+    subscriber = live_events.subscribe()
+    if subscriber is None:
+        return Response('Too many live viewers, retrying shortly.', status=503, headers={'Retry-After': '15'})
+    events = live_events.stream(
+        subscriber, request.args.get('set', type=int), app.config['LIVE_HEARTBEAT_SECONDS'],
+    )
+    response = Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # let nginx pass events through immediately
+    })
+    # Frees the slot even if the stream is closed before it starts
+    response.call_on_close(lambda: live_events.unsubscribe(subscriber))
+    return response
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+@app.cli.command('sweep-exams')
+def sweep_exams_command():
+    """Grade every exam whose time has run out."""
+    graded = sweep_expired(
+        _grade_exam, app.config['EXAM_DURATION_MINUTES'], app.config['DEADLINE_SWEEP_BATCH'], GRADE_GRACE,
     )
+    print(f'Graded {graded} expired exams.')
+
+
+@app.cli.command('regrade')
+@click.option('--set', 'set_id', type=int, required=True, help='Question set id.')
+@click.option('--question', 'question_id', type=int, help='Only this question.')
+@click.option('--apply', is_flag=True, help='Write the changes (default is a dry run).')
+def regrade_command(set_id, question_id, apply):
+    """Regrade finished exams after correct answers were edited."""
+    diffs, checked, unmatched, archived = _regrade(set_id, question_id, dry_run=not apply)
+    for d in diffs:
+        print(f'exam {d.exam_id} {d.email} ({d.index}): {d.old_score} -> {d.new_score} / {d.total}'
+              f'{" PASS->FAIL" if d.old_passed and not d.new_passed else ""}'
+              f'{" FAIL->PASS" if d.new_passed and not d.old_passed else ""}')
+    verb = 'Regraded' if apply else 'Would regrade'
+    print(f'{verb} {len(diffs)} of {checked} exams ({unmatched} question copies could not be matched).')
+    if archived:
+        print(f'{archived} archived exams of the set were not checked and keep their scores.')
+
+
+@app.cli.command('compact-papers')
+def compact_papers_command():
+    """Convert exams and prepared papers stored as full question copies."""
+    count = compact_papers()
+    print(f'Converted {count} papers to the compact format.')
+
+
+@app.cli.command('archive-exams')
+@click.option('--before', type=click.DateTime(formats=['%Y-%m-%d']), help='Exams finished before this date.')
+@click.option('--set', 'set_id', type=int, help='Every finished exam of this (retired) set.')
+@click.option('--vacuum', is_flag=True, help='Compact the database file afterwards.')
+def archive_exams_command(before, set_id, vacuum):
+    """Move old finished exams into the compressed archive (default: older than ARCHIVE_AFTER_DAYS)."""
+    if before is None and set_id is None:
+        before = datetime.utcnow() - timedelta(days=app.config['ARCHIVE_AFTER_DAYS'])
+    count, payload_bytes = archive_exams(finished_before=before, set_id=set_id)
+    print(f'Archived {count} exams into {payload_bytes} bytes of compressed payload.')
+    if vacuum:
+        db.session.execute(text('VACUUM'))
+        print('Vacuumed the database.')
+
+
+@app.cli.command('export-responses')
+@click.argument('directory')
+@click.option('--full', is_flag=True, help='Discard the previous export and start over.')
+def export_responses_command(directory, full):
+    """Append graded responses since the last run to a columnar NumPy export.
+
+    Exams regraded since the last run are exported again; load_responses
+    drops their older rows.
+    """
+    exams, rows = export_responses(directory, full=full)
+    print(f'Exported {rows} responses of {exams} exams to {directory}.')
+
+
+@app.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute per-set statistics from all graded exams."""
+    count = rebuild_set_stats()
+    print(f'Rebuilt statistics for {count} sets.')
 
 
 if __name__ == '__main__':
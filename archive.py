@@ -0,0 +1,87 @@
+"""Archival of old finished exams.
+
+``archive_exams`` moves finished exams out of ``Exam`` (and their rows out of
+``ExamAnswer``) into ``ArchivedExam``, keeping the summary columns the results
+list filters on and packing the paper and answers into one zlib-compressed
+JSON blob. Archived exams keep their id, so result links stay valid; they are
+no longer regraded and do not count in item analysis.
+
+``Exam.id`` has no AUTOINCREMENT, so SQLite would hand the id of an archived
+newest exam to the next new exam. New exams therefore take their id from
+``next_exam_id()``, which also looks at the archive.
+"""
+import json
+import zlib
+
+from sqlalchemy import delete, func, insert, select
+
+from models import db, ArchivedExam, Exam, ExamAnswer
+
+FORMAT = 1
+COMPRESSION_LEVEL = 9
+
+SUMMARY_FIELDS = (
+    'id', 'question_set_id', 'student_email', 'student_index', 'attempt',
+    'started_at', 'finished_at', 'regraded_at', 'score', 'total', 'passed',
+)
+
+
+def pack_exam(questions_data, answers):
+    """Compress a paper (as stored in ``Exam.questions_data``) and its answers."""
+    data = {'v': FORMAT, 'paper': questions_data, 'answers': answers}
+    return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def unpack_exam(payload):
+    """Return ``(questions_data, {question id (str): chosen key})`` of an archived exam."""
+    data = json.loads(zlib.decompress(payload))
+    return data['paper'], data['answers']
+
+
+def next_exam_id():
+    """Scalar subquery for the id of a new exam, above every live and archived exam."""
+    return func.max(
+        select(func.coalesce(func.max(Exam.id), 0)).scalar_subquery(),
+        select(func.coalesce(func.max(ArchivedExam.id), 0)).scalar_subquery(),
+    ) + 1
+
+
+def archive_exams(finished_before=None, set_id=None, batch_size=500):
+    """Move finished exams that finished before a date and/or belong to a set.
+
+    At least one criterion is required. Every batch is its own transaction.
+    Returns ``(exams archived, bytes of payload written)``.
+    """
+    if finished_before is None and set_id is None:
+        raise ValueError('archive_exams needs finished_before or set_id')
+    criteria = [Exam.finished_at.isnot(None)]
+    if finished_before is not None:
+        criteria.append(Exam.finished_at < finished_before)
+    if set_id is not None:
+        criteria.append(Exam.question_set_id == set_id)
+    columns = [getattr(Exam, f) for f in SUMMARY_FIELDS]
+
+    archived = payload_bytes = 0
+    while True:
+        rows = db.session.query(*columns, Exam.questions_data, Exam.answers_data).filter(
+            *criteria,
+        ).order_by(Exam.id).limit(batch_size).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        answers = {row.id: json.loads(row.answers_data) if row.answers_data else {} for row in rows}
+        for exam_id, qid, chosen in db.session.query(
+            ExamAnswer.exam_id, ExamAnswer.question_id, ExamAnswer.chosen,
+        ).filter(ExamAnswer.exam_id.in_(ids)):
+            answers[exam_id][str(qid)] = chosen
+        archive_rows = []
+        for row in rows:
+            payload = pack_exam(row.questions_data, answers[row.id])
+            payload_bytes += len(payload)
+            archive_rows.append({**{f: getattr(row, f) for f in SUMMARY_FIELDS}, 'payload': payload})
+        db.session.execute(insert(ArchivedExam), archive_rows)
+        db.session.execute(delete(ExamAnswer).where(ExamAnswer.exam_id.in_(ids)))
+        db.session.execute(delete(Exam).where(Exam.id.in_(ids)))
+        db.session.commit()
+        archived += len(ids)
+    return archived, payload_bytes
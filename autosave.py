@@ -0,0 +1,162 @@
+"""Write-behind buffer for exam autosaves.
+
+With ``AUTOSAVE_WRITE_BEHIND`` enabled, ``/exam/save`` only records the latest
+answers in memory and a background thread writes every pending exam in one
+transaction per flush interval. Submitting or grading an exam takes its
+pending answers first, and the buffer is flushed on interpreter exit.
+Answers buffered by another worker cannot be taken, so exams that run out of
+time are only graded once ``grace_seconds`` have passed since the deadline,
+by which time every worker has flushed them; saves after the deadline are
+rejected.
+Save sequence numbers are checked against the last save this worker accepted
+rather than ``Exam.save_seq``, so a stale save is only caught if the same
+worker saw the newer one.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from models import db, Exam
+
+log = logging.getLogger(__name__)
+
+
+class AnswerBuffer:
+    """Latest unsaved answers per exam for this worker."""
+
+    def __init__(self, app, write, interval, max_staleness):
+        self.app = app
+        self.write = write  # write(exam_id, {question id: chosen key}); committed here
+        self.interval = interval
+        self.max_staleness = max_staleness
+        # Every buffered answer is written within this long of being saved
+        self.grace_seconds = min(interval, max_staleness) + interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}
+        self._seqs = {}
+        self._oldest = None
+        self._thread = None
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.last_flush_rows = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.stale_saves = 0
+        self.dropped_answers = 0
+
+    def claim(self, exam_id, seq):
+        """Record ``seq`` as the exam's latest save; False if a newer one was accepted."""
+        with self._lock:
+            if seq <= self._seqs.get(exam_id, 0):
+                self.stale_saves += 1
+                return False
+            self._seqs[exam_id] = seq
+            return True
+
+    def save_seq(self, exam_id):
+        """Sequence number of the exam's latest accepted save, 0 if none."""
+        with self._lock:
+            return self._seqs.get(exam_id, 0)
+
+    def put(self, exam_id, changes):
+        """Buffer answers for an exam, replacing older values for the same questions."""
+        if not changes:
+            return
+        with self._lock:
+            self._pending.setdefault(exam_id, {}).update(changes)
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+            elif now - self._oldest >= self.max_staleness:
+                self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='autosave-flusher', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def pending(self, exam_id):
+        """Buffered answers for an exam that are not in the database yet."""
+        with self._lock:
+            return dict(self._pending.get(exam_id, {}))
+
+    def take(self, exam_id):
+        """Remove and return an exam's buffered answers so the caller can write them."""
+        with self._lock:
+            self._seqs.pop(exam_id, None)
+            return self._pending.pop(exam_id, {})
+
+    def flush(self):
+        """Write every buffered answer of unfinished exams in a single transaction.
+
+        Answers of exams graded in the meantime are dropped, and the save
+        sequence numbers of graded exams are forgotten.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._oldest = None
+            tracked = set(self._seqs)
+        if not batch and not tracked:
+            return 0
+        started = time.perf_counter()
+        rows = 0
+        try:
+            with self.app.app_context():
+                open_ids = {
+                    exam_id for (exam_id,) in db.session.query(Exam.id).filter(
+                        Exam.id.in_(tracked | set(batch)), Exam.finished_at.is_(None),
+                    )
+                }
+                for exam_id in open_ids & set(batch):
+                    self.write(exam_id, batch[exam_id])
+                    rows += len(batch[exam_id])
+                db.session.commit()
+        except Exception:
+            log.exception('Flushing %d buffered autosaves failed', len(batch))
+            self._restore(batch)
+            return 0
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            # Exams graded (or deleted) elsewhere get no more saves here
+            for exam_id in tracked - open_ids:
+                self._seqs.pop(exam_id, None)
+            self.dropped_answers += sum(len(batch[exam_id]) for exam_id in set(batch) - open_ids)
+            if not batch:
+                return 0
+            self.flushes += 1
+            self.rows_flushed += rows
+            self.last_flush_rows = rows
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        return rows
+
+    def _restore(self, batch):
+        """Put a failed batch back without overwriting answers buffered since."""
+        with self._lock:
+            for exam_id, changes in batch.items():
+                merged = dict(changes)
+                merged.update(self._pending.get(exam_id, {}))
+                self._pending[exam_id] = merged
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def _run(self):
+        while True:
+            self._wake.wait(min(self.interval, self.max_staleness))
+            self._wake.clear()
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending_exams': len(self._pending),
+                'pending_answers': sum(len(c) for c in self._pending.values()),
+                'flushes': self.flushes,
+                'rows_flushed': self.rows_flushed,
+                'last_flush_rows': self.last_flush_rows,
+                'flush_seconds_total': round(self.flush_seconds_total, 6),
+                'flush_seconds_max': round(self.flush_seconds_max, 6),
+                'stale_saves': self.stale_saves,
+                'dropped_answers': self.dropped_answers,
+            }
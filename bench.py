@@ -0,0 +1,362 @@
+"""Classroom load test for the exam lifecycle.
+
+Simulates students who log in, open the exam, autosave a few times and submit,
+against a freshly seeded question set. The app runs either in-process through
+Flask's test client or as a local gunicorn server. Per-route latency
+percentiles, throughput and SQLite lock errors are printed and can be written
+to a JSON baseline that later runs are compared against::
+
+    python bench.py --scenario classroom --output baseline.json
+    python bench.py --scenario classroom --baseline baseline.json
+    python bench.py --target gunicorn --workers 2 --students 200 --saves 5
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+
+# name: (students, bank size, questions per exam, autosave interval in seconds, saves per student)
+SCENARIOS = {
+    'smoke': (10, 30, 10, 0.2, 2),
+    'classroom': (60, 200, 20, 0.5, 4),
+    'lecture-hall': (250, 200, 20, 0.5, 4),
+    'large-bank': (60, 5000, 20, 0.5, 4),
+    'long-exam': (60, 500, 80, 0.5, 4),
+    'eager-autosave': (60, 200, 20, 0.1, 15),
+}
+
+QUESTION_FIELD = re.compile(r'name="q_(\d+)"')
+LOCK_MESSAGE = 'database is locked'
+
+
+class TestClientSession:
+    """One student's requests through Flask's test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code, response.get_data(as_text=True), response.headers.get('Location')
+
+
+class HttpSession:
+    """One student's requests over a keep-alive HTTP connection with its own cookie."""
+
+    def __init__(self, host, port):
+        self.conn = http.client.HTTPConnection(host, port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if data is not None:
+            body = urllib.parse.urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        self.conn.request(method, path, body=body, headers=headers)
+        response = self.conn.getresponse()
+        text = response.read().decode('utf-8', 'replace')
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        location = response.getheader('Location')
+        if location:
+            location = urllib.parse.urlsplit(location).path
+        return response.status, text, location
+
+
+class Recorder:
+    """Latencies and failures per route, shared by all student threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def timed(self, route, session, method, path, data=None, expect=(200, 302)):
+        started = time.perf_counter()
+        try:
+            status, text, location = session.request(method, path, data)
+        except (OSError, http.client.HTTPException):
+            status, text, location = None, '', None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if status not in expect:
+                self.errors[route] += 1
+        return status, text, location
+
+
+def student(recorder, session, set_uuid, number, interval, saves):
+    """Log in, open the exam, autosave ``saves`` times and submit."""
+    status, _, _ = recorder.timed('login', session, 'POST', f'/q/{set_uuid}/login', {
+        'email': f'student{number}@bench.test', 'index': str(number),
+    }, expect=(302,))
+    if status != 302:
+        return
+    status, page, _ = recorder.timed('exam', session, 'GET', '/exam', expect=(200,))
+    if status != 200:
+        return
+    question_ids = list(dict.fromkeys(QUESTION_FIELD.findall(page)))
+    answers = {}
+    for seq in range(1, saves + 1):
+        # Like exam.js: each save carries only the answers changed since the last one
+        time.sleep(interval * random.uniform(0.8, 1.2))
+        changed = {f'q_{qid}': random.choice('abcd')
+                   for qid in random.sample(question_ids, min(3, len(question_ids)))}
+        answers.update(changed)
+        recorder.timed('save', session, 'POST', '/exam/save', {
+            **changed, 'seq': str(seq), 'answered': str(len(answers)),
+        }, expect=(200,))
+    status, _, location = recorder.timed('submit', session, 'POST', '/exam/submit', answers, expect=(302,))
+    if status == 302 and location:
+        recorder.timed('result', session, 'GET', location, expect=(200,))
+
+
+def seed(app, bank_size):
+    """Create a question set with ``bank_size`` generated questions; returns its uuid."""
+    from sqlalchemy import insert
+    from models import db, Question, QuestionSet
+
+    with app.app_context():
+        qs = QuestionSet(name=f'bench {datetime.utcnow():%H:%M:%S.%f}')
+        db.session.add(qs)
+        db.session.commit()
+        db.session.execute(insert(Question), [
+            {
+                'question_set_id': qs.id,
+                'text': f'Benchmark question {i}: which option is correct?',
+                'option_a': f'Option A of {i}', 'option_b': f'Option B of {i}',
+                'option_c': f'Option C of {i}', 'option_d': f'Option D of {i}',
+                'correct': 'abcd'[i % 4],
+            }
+            for i in range(bank_size)
+        ])
+        db.session.commit()
+        return qs.uuid
+
+
+def summarize(recorder, wall_seconds, lock_errors):
+    routes = {}
+    total = 0
+    for route, samples in recorder.latencies.items():
+        ms = np.array(samples) * 1000
+        total += len(samples)
+        routes[route] = {
+            'count': len(samples),
+            'errors': recorder.errors[route],
+            'p50_ms': round(float(np.percentile(ms, 50)), 2),
+            'p95_ms': round(float(np.percentile(ms, 95)), 2),
+            'p99_ms': round(float(np.percentile(ms, 99)), 2),
+            'max_ms': round(float(ms.max()), 2),
+        }
+    return {
+        'wall_seconds': round(wall_seconds, 3),
+        'requests': total,
+        'throughput_rps': round(total / wall_seconds, 1) if wall_seconds else None,
+        'errors': sum(recorder.errors.values()),
+        'lock_errors': lock_errors,
+        'routes': routes,
+    }
+
+
+def run_students(make_session, set_uuid, students, interval, saves, ramp):
+    recorder = Recorder()
+    threads = []
+    started = time.perf_counter()
+    for number in range(students):
+        thread = threading.Thread(
+            target=student, args=(recorder, make_session(), set_uuid, number, interval, saves),
+        )
+        threads.append(thread)
+        thread.start()
+        if ramp:
+            time.sleep(ramp / students)
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def run_in_process(scenario, db_path, ramp):
+    """Drive the app through the test client; lock errors are caught from the app itself."""
+    students, bank_size, question_count, interval, saves = scenario
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    from flask import got_request_exception
+    from app import app
+
+    app.config['EXAM_QUESTION_COUNT'] = question_count
+    lock_errors = [0]
+
+    def count_lock_errors(sender, exception, **extra):
+        if LOCK_MESSAGE in str(exception):
+            lock_errors[0] += 1
+
+    got_request_exception.connect(count_lock_errors, app)
+    try:
+        set_uuid = seed(app, bank_size)
+        recorder, wall = run_students(
+            lambda: TestClientSession(app), set_uuid, students, interval, saves, ramp,
+        )
+    finally:
+        got_request_exception.disconnect(count_lock_errors, app)
+    return summarize(recorder, wall, lock_errors[0])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_gunicorn(scenario, db_path, ramp, workers, threads):
+    """Drive a local gunicorn server; lock errors are counted from its log."""
+    students, bank_size, question_count, interval, saves = scenario
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', EXAM_QUESTION_COUNT=str(question_count))
+    seeder = subprocess.run(
+        [sys.executable, '-c', f'import bench, app; print(bench.seed(app.app, {bank_size}))'],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    set_uuid = seeder.stdout.strip().splitlines()[-1]
+    port = _free_port()
+    with tempfile.TemporaryFile('w+') as log:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-k', 'gthread',
+             '--threads', str(threads), '-b', f'127.0.0.1:{port}', 'wsgi:app'],
+            env=env, stdout=log, stderr=log,
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if server.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError('gunicorn did not start')
+                    time.sleep(0.2)
+            recorder, wall = run_students(
+                lambda: HttpSession('127.0.0.1', port), set_uuid, students, interval, saves, ramp,
+            )
+        finally:
+            server.terminate()
+            server.wait(10)
+        log.seek(0)
+        lock_errors = log.read().count(LOCK_MESSAGE)
+    return summarize(recorder, wall, lock_errors)
+
+
+def compare(results, baseline, tolerance):
+    """Print p95 changes against a baseline; returns the number of regressions."""
+    regressions = 0
+    for name, result in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            print(f'{name}: not in baseline')
+            continue
+        for route, stats in result['routes'].items():
+            old = before['routes'].get(route)
+            if not old:
+                continue
+            change = (stats['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f'{name} {route:7} p95 {old["p95_ms"]:8.2f} -> {stats["p95_ms"]:8.2f} ms '
+                  f'({change:+.0%}){flag}')
+        if result['lock_errors'] > before['lock_errors']:
+            print(f'{name}: lock errors {before["lock_errors"]} -> {result["lock_errors"]}  REGRESSION')
+            regressions += 1
+    return regressions
+
+
+def print_result(name, params, result):
+    print(f'\n== {name} {params}')
+    print(f'{result["requests"]} requests in {result["wall_seconds"]}s, '
+          f'{result["throughput_rps"]} req/s, {result["errors"]} errors, '
+          f'{result["lock_errors"]} lock errors')
+    print(f'{"route":8}{"count":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for route in ('login', 'exam', 'save', 'submit', 'result'):
+        s = result['routes'].get(route)
+        if s:
+            print(f'{route:8}{s["count"]:>7}{s["errors"]:>8}{s["p50_ms"]:>10}{s["p95_ms"]:>10}'
+                  f'{s["p99_ms"]:>10}{s["max_ms"]:>10}')
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Predefined scenario; repeat to run several (default: classroom).')
+    parser.add_argument('--students', type=int, help='Override the number of students.')
+    parser.add_argument('--bank', type=int, help='Override the number of questions in the set.')
+    parser.add_argument('--questions', type=int, help='Override the questions per exam.')
+    parser.add_argument('--interval', type=float, help='Override the autosave interval in seconds.')
+    parser.add_argument('--saves', type=int, help='Override the autosaves per student.')
+    parser.add_argument('--ramp', type=float, default=2.0, help='Seconds over which students log in.')
+    parser.add_argument('--target', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers.')
+    parser.add_argument('--threads', type=int, default=16, help='Threads per gunicorn worker.')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--baseline', help='Compare p95 latencies with this JSON file.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed p95 increase over the baseline (default 0.2 = 20%%).')
+    args = parser.parse_args()
+
+    results = {
+        'revision': _git_revision(),
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'target': args.target,
+        'scenarios': {},
+    }
+    workdir = tempfile.mkdtemp(prefix='quiz-bench-')
+    overrides = (args.students, args.bank, args.questions, args.interval, args.saves)
+    for name in args.scenario or ['classroom']:
+        params = tuple(o if o is not None else d for o, d in zip(overrides, SCENARIOS[name]))
+        if args.target == 'client':
+            # The app binds its database at import, so all scenarios share one.
+            result = run_in_process(params, os.path.join(workdir, 'bench.db'), args.ramp)
+        else:
+            result = run_gunicorn(params, os.path.join(workdir, f'{name}.db'), args.ramp,
+                                  args.workers, args.threads)
+        result['params'] = dict(zip(('students', 'bank', 'questions', 'interval', 'saves'), params))
+        results['scenarios'][name] = result
+        print_result(name, result['params'], result)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nWrote {args.output}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f'\nCompared with {args.baseline} (revision {baseline.get("revision")}):')
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
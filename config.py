@@ -8,7 +8,43 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY', 'change-me-in-production')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///quiz.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # SQLite pragmas applied on every connection; an empty value skips the pragma.
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_CACHE_SIZE = os.environ.get('SQLITE_CACHE_SIZE', '-20000')  # negative = KiB
+    SQLITE_MMAP_SIZE = os.environ.get('SQLITE_MMAP_SIZE', '268435456')
     TEACHER_PASSWORD = os.environ.get('TEACHER_PASSWORD', 'teacher123')
     EXAM_DURATION_MINUTES = int(os.environ.get('EXAM_DURATION_MINUTES', '20'))
     EXAM_QUESTION_COUNT = int(os.environ.get('EXAM_QUESTION_COUNT', '20'))
     PASS_THRESHOLD = float(os.environ.get('PASS_THRESHOLD', '0.5'))
+    # Seconds between background sweeps that grade expired exams; 0 disables.
+    DEADLINE_SWEEP_SECONDS = float(os.environ.get('DEADLINE_SWEEP_SECONDS', '10'))
+    DEADLINE_SWEEP_BATCH = int(os.environ.get('DEADLINE_SWEEP_BATCH', '100'))
+    # Regrades of at least this many exams are scored in a process pool.
+    REGRADE_WORKERS = int(os.environ.get('REGRADE_WORKERS', str(os.cpu_count() or 1)))
+    REGRADE_PARALLEL_MIN_EXAMS = int(os.environ.get('REGRADE_PARALLEL_MIN_EXAMS', '50000'))
+    # Parsed papers of this many exams are kept in memory per worker.
+    EXAM_STATE_CACHE_SIZE = int(os.environ.get('EXAM_STATE_CACHE_SIZE', '5000'))
+    # Total size of rendered finished-result pages kept in memory per worker.
+    RESULT_PAGE_CACHE_BYTES = int(os.environ.get('RESULT_PAGE_CACHE_BYTES', str(16 * 1024 * 1024)))
+    # Shared file that fans live dashboard events out across gunicorn workers;
+    # empty keeps events within each worker (fine for a single worker).
+    LIVE_EVENTS_FILE = os.environ.get('LIVE_EVENTS_FILE', '')
+    LIVE_EVENTS_MAX_BYTES = int(os.environ.get('LIVE_EVENTS_MAX_BYTES', str(1024 * 1024)))
+    LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', '15'))
+    # Each open live stream holds one of a worker's threads; more viewers get a 503 and retry.
+    LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', '4'))
+    # Request/SQL timings on /teacher/metrics; requests slower than SLOW_REQUEST_MS are logged.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '500'))
+    RESULTS_PAGE_SIZE = int(os.environ.get('RESULTS_PAGE_SIZE', '50'))
+    QUESTIONS_PAGE_SIZE = int(os.environ.get('QUESTIONS_PAGE_SIZE', '100'))
+    # `flask archive-exams` without options archives exams finished longer ago than this.
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '365'))
+    # Refill a set's paper pool in the background once it drops below this fraction.
+    PAPER_POOL_REFILL_BELOW = float(os.environ.get('PAPER_POOL_REFILL_BELOW', '0.25'))
+    # Buffer autosaves in memory and write them in one transaction per interval.
+    AUTOSAVE_WRITE_BEHIND = os.environ.get('AUTOSAVE_WRITE_BEHIND', '0') == '1'
+    AUTOSAVE_FLUSH_SECONDS = float(os.environ.get('AUTOSAVE_FLUSH_SECONDS', '5'))
+    AUTOSAVE_MAX_STALENESS_SECONDS = float(os.environ.get('AUTOSAVE_MAX_STALENESS_SECONDS', '15'))
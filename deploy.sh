@@ -22,7 +22,7 @@ REMOTE
 
 # Copy application files
 echo "Copying files..."
-rsync -avz --exclude '__pycache__' --exclude '*.db' --exclude '.env' --exclude 'venv' \
+rsync -avz --exclude '__pycache__' --exclude '*.db' --exclude '*.db-wal' --exclude '*.db-shm' --exclude '.env' --exclude 'venv' \
     -e "ssh -p $SSH_PORT" \
     ./ "${SSH_HOST}:${APP_DIR}/"
 
@@ -57,7 +57,10 @@ After=network.target
 [Service]
 User=${APP_USER}
 WorkingDirectory=${APP_DIR}
-ExecStart=${APP_DIR}/venv/bin/gunicorn -w 2 -b 127.0.0.1:5000 wsgi:app
+# Threaded workers: an open live dashboard stream holds a thread, and each worker
+# serves at most LIVE_MAX_STREAMS (default 4) of them, leaving the rest to exams
+ExecStart=${APP_DIR}/venv/bin/gunicorn -w 2 -k gthread --threads 16 -b 127.0.0.1:5000 wsgi:app
+Environment=LIVE_EVENTS_FILE=${APP_DIR}/live-events.jsonl
 Restart=always
 EnvironmentFile=${APP_DIR}/.env
 
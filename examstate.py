@@ -0,0 +1,102 @@
+"""Parsed exam state, cached per worker.
+
+The exam page, autosave, submit and result pages all need an exam's decoded
+paper and its set. Neither changes while the exam is open, so they are
+decoded once and kept in a bounded LRU keyed by exam id. Grading evicts the
+exam; finished exams are re-read when ``Exam.regraded_at`` has moved.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from models import db, Exam, QuestionSet
+from papers import decode_paper
+
+ExamState = namedtuple(
+    'ExamState',
+    'exam_id set_id student_email student_index started_at regraded_at questions question_ids question_set',
+)
+SetInfo = namedtuple('SetInfo', 'id uuid name')
+
+
+def _build(exam_id, set_id, email, index, started_at, regraded_at, questions_data, set_uuid, set_name):
+    questions = decode_paper(questions_data)
+    return ExamState(
+        exam_id, set_id, email, index, started_at, regraded_at, questions,
+        frozenset(str(q['id']) for q in questions),
+        SetInfo(set_id, set_uuid, set_name) if set_uuid is not None else None,
+    )
+
+
+class ExamStateCache:
+    """``ExamState`` by exam id, least recently used first out."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._states = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, exam_id, regraded_at=None, check_regrade=False):
+        with self._lock:
+            state = self._states.get(exam_id)
+            if state is not None and (not check_regrade or state.regraded_at == regraded_at):
+                self._states.move_to_end(exam_id)
+                self.hits += 1
+                return state
+            self.misses += 1
+            return None
+
+    def _store(self, state):
+        with self._lock:
+            self._states[state.exam_id] = state
+            self._states.move_to_end(state.exam_id)
+            while len(self._states) > self.max_size:
+                self._states.popitem(last=False)
+        return state
+
+    def get(self, exam_id):
+        """State of an unfinished exam without loading the ORM row; None if there is none."""
+        state = self._lookup(exam_id)
+        if state is not None:
+            return state
+        row = db.session.query(
+            Exam.id, Exam.question_set_id, Exam.student_email, Exam.student_index,
+            Exam.started_at, Exam.regraded_at,
+            Exam.questions_data, QuestionSet.uuid, QuestionSet.name,
+        ).outerjoin(QuestionSet, QuestionSet.id == Exam.question_set_id).filter(
+            Exam.id == exam_id, Exam.finished_at.is_(None),
+        ).first()
+        return self._store(_build(*row)) if row is not None else None
+
+    def for_exam(self, exam):
+        """State of a loaded ``Exam``, rebuilt if the exam was regraded since it was cached."""
+        state = self._lookup(exam.id, exam.regraded_at, check_regrade=True)
+        if state is not None:
+            return state
+        qs = db.session.get(QuestionSet, exam.question_set_id)
+        return self._store(_build(
+            exam.id, exam.question_set_id, exam.student_email, exam.student_index,
+            exam.started_at, exam.regraded_at,
+            exam.questions_data, qs.uuid if qs else None, qs.name if qs else None,
+        ))
+
+    def discard(self, exam_id):
+        with self._lock:
+            self._states.pop(exam_id, None)
+
+    def discard_set(self, set_id):
+        with self._lock:
+            for exam_id in [i for i, s in self._states.items() if s.set_id == set_id]:
+                del self._states[exam_id]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._states),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+            }
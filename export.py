@@ -0,0 +1,305 @@
+"""Columnar export of graded responses for offline analysis.
+
+``export_responses`` writes one row per (exam, question) of every finished
+exam, live or archived, into a directory of NumPy arrays::
+
+    manifest.json               columns, parts, watermark, exported_at, row count
+    students.json               dictionary for the ``student`` column: [email, index] by code
+    part-00001/exam_id.npy      one .npy file per column and part
+    ...
+
+Each run appends a part with the exams above the manifest's watermark, so
+a nightly run only reads the new exams. Exams are exported in id order and
+only up to the oldest exam still running: ids are handed out at login, so an
+exam started earlier can finish later, and the watermark must not pass it.
+
+Regrades change exams below the watermark. Each run therefore also exports
+again the exams regraded since the previous run (``Exam.regraded_at`` after
+the manifest's ``exported_at``); the part holding their new rows lists them
+under ``supersedes`` and ``load_responses`` drops their rows from earlier
+parts.
+
+Keys are in the question's original option order (0-3 for a-d, -1 for
+unanswered or unknown). Arrays are plain ``.npy`` files rather than ``.npz``
+so that ``load_responses`` can memory-map them.
+"""
+import heapq
+import json
+import os
+from datetime import datetime
+from itertools import chain, islice
+
+import numpy as np
+from sqlalchemy import func
+
+from archive import unpack_exam
+from models import db, ArchivedExam, Exam, ExamAnswer, Question, QuestionVersion
+from papers import KEYS, is_compact
+
+FORMAT = 2  # 2 added exported_at and superseding parts
+PART_ROWS = 1_000_000  # a run with more rows than this writes several parts
+COLUMNS = {
+    'exam_id': np.int32,
+    'set_id': np.int32,
+    'student': np.int32,  # code into students.json
+    'question_id': np.int32,
+    'position': np.int16,  # 0-based place of the question on the paper
+    'correct': np.int8,  # original key of the correct option
+    'chosen': np.int8,  # original key of the chosen option, -1 if unanswered
+    'is_correct': np.bool_,
+    'started_at': 'datetime64[s]',
+    'finished_at': 'datetime64[s]',
+}
+MANIFEST = 'manifest.json'
+STUDENTS = 'students.json'
+
+
+def _read_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json(path, data):
+    """Write through a temporary file so a crash never leaves a half-written file."""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _export_ceiling():
+    """Highest exam id below every unfinished exam (all exams up to it are graded)."""
+    oldest_running = db.session.query(func.min(Exam.id)).filter(Exam.finished_at.is_(None)).scalar()
+    if oldest_running is not None:
+        return oldest_running - 1
+    return max(
+        db.session.query(func.max(Exam.id)).scalar() or 0,
+        db.session.query(func.max(ArchivedExam.id)).scalar() or 0,
+    )
+
+
+def _exams(model, after, ceiling, batch_size, regraded_since=None):
+    """Finished exams of one model with ids in (``after``, ``ceiling``], in id order.
+
+    With ``regraded_since`` only the exams regraded after it. Each exam is
+    ``(id, set id, email, index, started_at, finished_at, questions_data,
+    {question id (str): chosen key})``.
+    """
+    data = ArchivedExam.payload if model is ArchivedExam else Exam.questions_data
+    criteria = [model.finished_at.isnot(None), model.id <= ceiling]
+    if regraded_since is not None:
+        criteria.append(model.regraded_at > regraded_since)
+    last_id = after
+    while True:
+        rows = db.session.query(
+            model.id, model.question_set_id, model.student_email, model.student_index,
+            model.started_at, model.finished_at, data,
+            *(() if model is ArchivedExam else (Exam.answers_data,)),
+        ).filter(model.id > last_id, *criteria).order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        if model is ArchivedExam:
+            yield from ((*row[:6], *unpack_exam(row[6])) for row in rows)
+            continue
+        answers = {row.id: json.loads(row.answers_data) if row.answers_data else {} for row in rows}
+        for exam_id, qid, chosen in db.session.query(
+            ExamAnswer.exam_id, ExamAnswer.question_id, ExamAnswer.chosen,
+        ).filter(ExamAnswer.exam_id.in_(answers)):
+            answers[exam_id][str(qid)] = chosen
+        yield from ((*row[:7], answers[row.id]) for row in rows)
+
+
+def _exam_batches(after, ceiling, batch_size, regraded_since=None):
+    """Lists of up to ``batch_size`` live and archived exams (see ``_exams``), merged in id order."""
+    exams = heapq.merge(
+        _exams(Exam, after, ceiling, batch_size, regraded_since),
+        _exams(ArchivedExam, after, ceiling, batch_size, regraded_since),
+        key=lambda exam: exam[0],
+    )
+    while batch := list(islice(exams, batch_size)):
+        yield batch
+
+
+def _paper_rows(questions_data, versions, legacy_options):
+    """``(question id, correct key, {shown key: original key})`` per question of a paper."""
+    if is_compact(questions_data):
+        for version_id, perm, *override in json.loads(questions_data)['q']:
+            qid, correct = versions.get(version_id, (None, None))
+            if qid is None:
+                continue
+            key = override[0] if override else correct
+            yield qid, KEYS.index(key), {shown: KEYS.index(original) for shown, original in zip(KEYS, perm)}
+        return
+    # Full-copy papers from before snapshots: map options back by their text
+    for q in json.loads(questions_data):
+        original = {text: k for k, text in enumerate(legacy_options.get(q['id'], ()))}
+        keys = {shown: original.get(q[f'option_{shown}'], -1) for shown in KEYS}
+        yield q['id'], keys[q['correct']], keys
+
+
+def _batch_lookups(batch):
+    """Snapshot (question id, correct) by version id and current options of legacy questions."""
+    version_ids, legacy_ids = set(), set()
+    for exam in batch:
+        if is_compact(exam[6]):
+            version_ids.update(entry[0] for entry in json.loads(exam[6])['q'])
+        else:
+            legacy_ids.update(q['id'] for q in json.loads(exam[6]))
+    versions = {}
+    if version_ids:
+        versions = {
+            vid: (qid, correct) for vid, qid, correct in db.session.query(
+                QuestionVersion.id, QuestionVersion.question_id, QuestionVersion.correct,
+            ).filter(QuestionVersion.id.in_(version_ids))
+        }
+    legacy_options = {}
+    if legacy_ids:
+        legacy_options = {
+            qid: options for qid, *options in db.session.query(
+                Question.id, Question.option_a, Question.option_b, Question.option_c, Question.option_d,
+            ).filter(Question.id.in_(legacy_ids))
+        }
+    return versions, legacy_options
+
+
+class _PartWriter:
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.columns = {name: [] for name in COLUMNS}
+        self.rows = 0
+        self.supersedes = []  # exams whose rows in earlier parts this part replaces
+
+    def add(self, **values):
+        for name, value in values.items():
+            self.columns[name].append(value)
+        self.rows += 1
+        if self.rows >= PART_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        name = f'part-{len(self.manifest["parts"]) + 1:05d}'
+        os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        exam_ids = np.asarray(self.columns['exam_id'], dtype=COLUMNS['exam_id'])
+        for column, dtype in COLUMNS.items():
+            values = np.asarray(self.columns[column], dtype=dtype)
+            np.save(os.path.join(self.directory, name, f'{column}.npy'), values)
+        self.manifest['parts'].append({
+            'name': name,
+            'rows': self.rows,
+            'min_exam_id': int(exam_ids.min()),
+            'max_exam_id': int(exam_ids.max()),
+            'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+            **({'supersedes': self.supersedes} if self.supersedes else {}),
+        })
+        self.manifest['rows'] += self.rows
+        self.columns = {name: [] for name in COLUMNS}
+        self.rows = 0
+        self.supersedes = []
+
+
+def export_responses(directory, batch_size=1000, full=False):
+    """Append responses of exams finished or regraded since the last export to ``directory``.
+
+    With ``full`` the directory's previous export is discarded first. Returns
+    ``(exams exported, rows written)``, counting regraded exams exported again.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    students_path = os.path.join(directory, STUDENTS)
+    manifest = None if full else _read_json(manifest_path, None)
+    if manifest is None or manifest.get('format') != FORMAT:
+        manifest = {
+            'format': FORMAT,
+            'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+            'keys': KEYS,
+            'watermark': 0,
+            'exported_at': None,
+            'rows': 0,
+            'parts': [],
+        }
+        students = []
+    else:
+        students = _read_json(students_path, [])
+    codes = {tuple(student): code for code, student in enumerate(students)}
+
+    # Taken before reading, so a regrade committed during the run is exported again next time
+    exported_at = datetime.utcnow()
+    ceiling = _export_ceiling()
+    writer = _PartWriter(directory, manifest)
+    rows_before = manifest['rows']  # full parts are written, and counted, during the loop
+    superseded_rows = 0
+    watermark = manifest['watermark']
+    regraded = ()
+    if manifest['exported_at']:
+        regraded_since = datetime.fromisoformat(manifest['exported_at'])
+        regraded = _exam_batches(0, watermark, batch_size, regraded_since)
+    exams = 0
+    for batch in chain(regraded, _exam_batches(watermark, ceiling, batch_size)):
+        versions, legacy_options = _batch_lookups(batch)
+        for exam_id, set_id, email, index, started_at, finished_at, questions_data, answers in batch:
+            if exam_id <= watermark:
+                # Listed by the part that gets the exam's first new row
+                writer.supersedes.append(exam_id)
+            student = codes.setdefault((email, index), len(codes))
+            if student == len(students):
+                students.append([email, index])
+            position = -1
+            for position, (qid, correct, original) in enumerate(
+                _paper_rows(questions_data, versions, legacy_options),
+            ):
+                shown = answers.get(str(qid))
+                chosen = original.get(shown, -1) if shown else -1
+                writer.add(
+                    exam_id=exam_id, set_id=set_id, student=student, question_id=qid,
+                    position=position, correct=correct, chosen=chosen,
+                    is_correct=chosen >= 0 and chosen == correct,
+                    started_at=started_at, finished_at=finished_at,
+                )
+            if exam_id <= watermark:
+                # A regrade keeps the paper, so it replaces as many rows as it wrote
+                superseded_rows += position + 1
+            exams += 1
+    writer.flush()
+    manifest['watermark'] = max(watermark, ceiling)
+    manifest['exported_at'] = exported_at.isoformat()
+    manifest['rows'] -= superseded_rows
+    # Parts and the dictionary first: until the manifest names them they are ignored
+    _write_json(students_path, students)
+    _write_json(manifest_path, manifest)
+    return exams, manifest['rows'] + superseded_rows - rows_before
+
+
+def load_responses(directory, mmap_mode='r'):
+    """Return ``(manifest, students, parts)``; each part maps column names to (memory-mapped) arrays.
+
+    Rows of regraded exams are dropped from the parts written before their
+    regrade was exported; those parts are loaded into memory instead of
+    memory-mapped. ``np.concatenate([part['chosen'] for part in parts])``
+    gives a whole column.
+    """
+    manifest = _read_json(os.path.join(directory, MANIFEST), None)
+    if manifest is None:
+        raise FileNotFoundError(f'no {MANIFEST} in {directory}')
+    students = _read_json(os.path.join(directory, STUDENTS), [])
+    parts = []
+    superseded = set()  # exams exported again by a later part
+    for part in reversed(manifest['parts']):
+        columns = {
+            column: np.load(os.path.join(directory, part['name'], f'{column}.npy'), mmap_mode=mmap_mode)
+            for column in manifest['columns']
+        }
+        if superseded:
+            keep = ~np.isin(columns['exam_id'], list(superseded))
+            if not keep.all():
+                columns = {column: values[keep] for column, values in columns.items()}
+        superseded.update(part.get('supersedes', ()))
+        parts.append(columns)
+    parts.reverse()
+    return manifest, students, parts
@@ -0,0 +1,101 @@
+"""Bulk CSV import of questions into a set.
+
+Rows are read in chunks, validated, checked against the normalized content
+hash of the set's existing questions and inserted with one executemany per
+chunk. Every data row gets a report entry.
+"""
+import csv
+from collections import namedtuple
+from itertools import islice
+
+from sqlalchemy import insert, update
+
+from models import db, Question
+
+CHUNK_ROWS = 1000
+OPTION_COLUMNS = ('option_a', 'option_b', 'option_c', 'option_d')
+TEXT_COLUMNS = ('text', 'question')  # 'question' is accepted as an alias
+
+IMPORTED = 'imported'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+ReportRow = namedtuple('ReportRow', 'line status reason')
+
+
+class ImportFormatError(ValueError):
+    """The file as a whole cannot be imported (e.g. missing columns)."""
+
+
+def _validate(row):
+    """Return (question values, None) for a valid row or (None, reason)."""
+    text = next((row[c] for c in TEXT_COLUMNS if row.get(c) is not None), None)
+    values = {'text': (text or '').strip()}
+    for column in OPTION_COLUMNS:
+        values[column] = (row.get(column) or '').strip()
+    values['correct'] = (row.get('correct') or '').strip().lower()
+    missing = [k for k, v in values.items() if not v]
+    if missing:
+        return None, f'empty {", ".join(missing)}'
+    if values['correct'] not in ('a', 'b', 'c', 'd'):
+        return None, f'correct must be a, b, c or d (got "{values["correct"]}")'
+    too_long = [c for c in OPTION_COLUMNS if len(values[c]) > 500]
+    if too_long:
+        return None, f'{", ".join(too_long)} longer than 500 characters'
+    return values, None
+
+
+def _known_hashes(set_id):
+    """Content hashes of the set's questions, filling in any that are missing."""
+    known = set()
+    backfill = []
+    rows = db.session.query(
+        Question.id, Question.content_hash, Question.text, Question.option_a,
+        Question.option_b, Question.option_c, Question.option_d, Question.correct,
+    ).filter(Question.question_set_id == set_id)
+    for qid, content_hash, *fields in rows:
+        if content_hash is None:
+            content_hash = Question.content_hash_for(*fields)
+            backfill.append({'id': qid, 'content_hash': content_hash})
+        known.add(content_hash)
+    if backfill:
+        db.session.execute(update(Question), backfill)
+    return known
+
+
+def import_questions(set_id, stream):
+    """Import questions from a CSV text stream into a set; committed by the caller.
+
+    Returns a list of ``ReportRow`` (one per data row, ``line`` as in the file).
+    """
+    reader = csv.DictReader(stream)
+    columns = set(reader.fieldnames or ())
+    missing = [c for c in (*OPTION_COLUMNS, 'correct') if c not in columns]
+    if not columns.intersection(TEXT_COLUMNS):
+        missing.insert(0, 'text')
+    if missing:
+        raise ImportFormatError(f'missing columns: {", ".join(missing)}')
+
+    numbered = ((reader.line_num, row) for row in reader)
+    known = _known_hashes(set_id)
+    report = []
+    while True:
+        chunk = list(islice(numbered, CHUNK_ROWS))
+        if not chunk:
+            break
+        inserts = []
+        for line, row in chunk:
+            values, reason = _validate(row)
+            if values is None:
+                report.append(ReportRow(line, INVALID, reason))
+                continue
+            content_hash = Question.content_hash_for(**values)
+            if content_hash in known:
+                report.append(ReportRow(line, DUPLICATE, 'same question already in this set'))
+                continue
+            known.add(content_hash)
+            inserts.append({**values, 'question_set_id': set_id, 'content_hash': content_hash})
+            report.append(ReportRow(line, IMPORTED, ''))
+        if inserts:
+            db.session.execute(insert(Question), inserts)
+    return report
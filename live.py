@@ -0,0 +1,144 @@
+"""Live exam events for the teacher's proctoring page.
+
+Exam routes publish small events (started, saved, submitted, expired). Each
+worker fans them out to its open Server-Sent Events streams through an
+in-process hub, so any number of teacher tabs costs one queue put per event
+and no database polling. With several gunicorn workers, events are appended
+to a shared ``LIVE_EVENTS_FILE`` instead and every worker tails that file
+into its own hub.
+"""
+import fcntl
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class LiveHub:
+    """Broadcasts event dicts to every subscribed stream of this worker."""
+
+    def __init__(self, events_file='', max_bytes=1024 * 1024, poll_interval=0.25, queue_size=1000,
+                 max_streams=None):
+        self.events_file = events_file
+        self.max_bytes = max_bytes
+        self.max_streams = max_streams  # each open stream holds a worker thread
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._tailer = None
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.refused = 0
+
+    def publish(self, event):
+        with self._lock:
+            self.published += 1
+        if self.events_file:
+            try:
+                self._append(json.dumps(event, separators=(',', ':')))
+            except OSError:
+                log.exception('Writing live event to %s failed', self.events_file)
+        else:
+            self._deliver(event)
+
+    def subscribe(self):
+        """A queue that receives every event, or None if ``max_streams`` are open."""
+        subscriber = queue.Queue(self.queue_size)
+        with self._lock:
+            if self.max_streams is not None and len(self._subscribers) >= self.max_streams:
+                self.refused += 1
+                return None
+            self._subscribers.add(subscriber)
+            if self.events_file and self._tailer is None:
+                self._tailer = threading.Thread(target=self._tail, name='live-events-tailer', daemon=True)
+                self._tailer.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def _deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+                delivered = True
+            except queue.Full:
+                delivered = False  # a stalled stream must not hold up the others
+            with self._lock:
+                if delivered:
+                    self.delivered += 1
+                else:
+                    self.dropped += 1
+
+    def _append(self, line):
+        with open(self.events_file, 'a', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if f.tell() > self.max_bytes:
+                f.truncate(0)  # tailers notice the file shrank and start over
+            f.write(line + '\n')
+            f.flush()
+
+    def _size(self):
+        try:
+            return os.path.getsize(self.events_file)
+        except FileNotFoundError:
+            return 0  # no event written yet
+
+    def _tail(self):
+        position = self._size()
+        partial = b''
+        while True:
+            try:
+                size = self._size()
+                if size < position:
+                    position, partial = 0, b''
+                if size > position:
+                    with open(self.events_file, 'rb') as f:
+                        f.seek(position)
+                        data = f.read(size - position)
+                    position += len(data)
+                    *lines, partial = (partial + data).split(b'\n')
+                    for line in lines:
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            continue  # empty, or cut by a truncation between polls
+                        self._deliver(event)
+            except OSError:
+                log.exception('Reading live events from %s failed', self.events_file)
+            time.sleep(self.poll_interval)
+
+    def stream(self, subscriber, set_id=None, heartbeat=15):
+        """Yield Server-Sent Events from a subscription, optionally only for one set."""
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if set_id is None or event.get('set') == set_id:
+                    yield f'event: {event["type"]}\ndata: {json.dumps(event)}\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+                'refused': self.refused,
+                'max_streams': self.max_streams,
+            }
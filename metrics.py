@@ -0,0 +1,220 @@
+"""Opt-in request, SQL and section timings in Prometheus text format.
+
+With ``METRICS_ENABLED`` unset nothing is hooked up: ``Metrics.timed`` returns
+functions unchanged and no request or engine listeners are registered. When
+enabled, every request records its latency and the number and duration of its
+SQL statements and commits, and requests slower than ``SLOW_REQUEST_MS`` are
+logged with that breakdown. Like ``/teacher/stats``, the numbers are per
+worker process.
+"""
+import bisect
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+log = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{n}="{escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, label_names=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket..., sum, count]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1  # last slot past the buckets is +Inf
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), series):
+                cumulative += count
+                labels = _labels((*self.label_names, 'le'), (*label_values, bound))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels(self.label_names, label_values)
+            lines.append(f'{self.name}_sum{labels} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_labels(self.label_names, label_values)} {value}')
+        return lines
+
+
+class Metrics:
+    """Per-process metrics registry; a no-op unless ``enabled``."""
+
+    def __init__(self, enabled=False, slow_request_ms=0):
+        self.enabled = enabled
+        self.slow_request_ms = slow_request_ms
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.requests = Counter('quiz_requests_total', 'Requests by endpoint and status.',
+                                ('endpoint', 'status'))
+        self.request_seconds = Histogram('quiz_request_duration_seconds',
+                                         'Request latency by endpoint.', ('endpoint',))
+        self.request_statements = Histogram('quiz_request_sql_statements',
+                                            'SQL statements per request.', ('endpoint',), COUNT_BUCKETS)
+        self.request_sql_seconds = Histogram('quiz_request_sql_seconds',
+                                             'Time in SQL statements and commits per request.', ('endpoint',))
+        self.statement_seconds = Histogram('quiz_sql_statement_duration_seconds',
+                                           'SQL statement latency by verb, including lock waits.', ('verb',))
+        self.commit_seconds = Histogram('quiz_sql_commit_duration_seconds',
+                                        'Database commit latency, including lock waits.')
+        self.section_seconds = Histogram('quiz_section_duration_seconds',
+                                         'Time spent in instrumented functions.', ('section',))
+        self.template_seconds = Histogram('quiz_template_render_seconds',
+                                          'Template rendering time.', ('template',))
+        self.slow_requests = Counter('quiz_slow_requests_total',
+                                     'Requests slower than SLOW_REQUEST_MS.', ('endpoint',))
+
+    def _observe(self, metric, value, *labels):
+        with self._lock:
+            metric.observe(value, *labels)
+
+    def timed(self, section):
+        """Decorator recording a function's duration under ``section`` when enabled."""
+        def decorate(f):
+            if not self.enabled:
+                return f
+
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self._observe(self.section_seconds, time.perf_counter() - started, section)
+            return wrapper
+        return decorate
+
+    def instrument(self, app, engine):
+        """Register the request, template, SQL and commit hooks."""
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._record_status)
+        app.teardown_request(self._finish_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+        event.listen(engine, 'before_cursor_execute', self._start_statement)
+        event.listen(engine, 'after_cursor_execute', self._finish_statement)
+        event.listen(engine, 'commit', self._start_commit)
+        event.listen(engine, 'rollback', self._abandon_commit)
+        event.listen(Session, 'after_commit', self._finish_commit)
+
+    # --- hooks ---
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql = [0, 0.0, 0.0]  # statements, statement seconds, commit seconds
+
+    def _record_status(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _finish_request(self, exc=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        statements, statement_seconds, commit_seconds = g.pop('metrics_sql')
+        status = g.pop('metrics_status', 500 if exc else 200)
+        with self._lock:
+            self.requests.inc(endpoint, status)
+            self.request_seconds.observe(elapsed, endpoint)
+            self.request_statements.observe(statements, endpoint)
+            self.request_sql_seconds.observe(statement_seconds + commit_seconds, endpoint)
+            slow = self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms
+            if slow:
+                self.slow_requests.inc(endpoint)
+        if slow:
+            log.warning(
+                'Slow request %s %s -> %s: %.1f ms, %d SQL statements in %.1f ms, commits %.1f ms',
+                request.method, request.path, status, elapsed * 1000,
+                statements, statement_seconds * 1000, commit_seconds * 1000,
+            )
+
+    def _start_render(self, sender, template, context, **extra):
+        g.setdefault('metrics_renders', []).append(time.perf_counter())
+
+    def _finish_render(self, sender, template, context, **extra):
+        renders = g.get('metrics_renders')
+        if renders:
+            self._observe(self.template_seconds, time.perf_counter() - renders.pop(), template.name)
+
+    def _start_statement(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+    def _finish_statement(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+        self._observe(self.statement_seconds, elapsed, statement.lstrip().split(None, 1)[0].upper())
+        if has_request_context() and 'metrics_sql' in g:
+            g.metrics_sql[0] += 1
+            g.metrics_sql[1] += elapsed
+
+    def _start_commit(self, conn):
+        # Fires right before the DBAPI commit; the session's after_commit right after it.
+        self._local.commit_started = time.perf_counter()
+
+    def _finish_commit(self, session):
+        started = getattr(self._local, 'commit_started', None)
+        self._local.commit_started = None
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        self._observe(self.commit_seconds, elapsed)
+        if has_request_context() and 'metrics_sql' in g:
+            g.metrics_sql[2] += elapsed
+
+    def _abandon_commit(self, conn):
+        self._local.commit_started = None
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+            for metric in (self.requests, self.request_seconds, self.request_statements,
+                           self.request_sql_seconds, self.statement_seconds, self.commit_seconds,
+                           self.section_seconds, self.template_seconds, self.slow_requests):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
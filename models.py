@@ -1,6 +1,9 @@
+import hashlib
+import json
 import uuid as _uuid
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, text
 
 db = SQLAlchemy()
 
@@ -10,14 +13,24 @@ class QuestionSet(db.Model):
     uuid = db.Column(db.String(36), unique=True, nullable=False, default=lambda: str(_uuid.uuid4()))
     name = db.Column(db.String(200), nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+    # Bumped whenever the set's questions change; keys the per-process pool cache.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Number of pre-generated papers to keep ready; 0 disables the paper pool.
+    paper_pool_size = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     questions = db.relationship('Question', backref='question_set', lazy=True, cascade='all, delete-orphan')
     exams = db.relationship('Exam', backref='question_set', lazy=True, cascade='all, delete-orphan')
+    papers = db.relationship('ExamPaper', lazy=True, cascade='all, delete-orphan')
+    stats = db.relationship('SetStats', lazy=True, uselist=False, cascade='all, delete-orphan')
 
 
 class Question(db.Model):
+    __table_args__ = (
+        db.Index('ix_question_set_hash', 'question_set_id', 'content_hash'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    question_set_id = db.Column(db.Integer, db.ForeignKey('question_set.id'), nullable=False)
+    question_set_id = db.Column(db.Integer, db.ForeignKey('question_set.id'), nullable=False, index=True)
     text = db.Column(db.Text, nullable=False)
     option_a = db.Column(db.String(500), nullable=False)
     option_b = db.Column(db.String(500), nullable=False)
@@ -25,6 +38,24 @@ class Question(db.Model):
     option_d = db.Column(db.String(500), nullable=False)
     correct = db.Column(db.String(1), nullable=False)  # 'a', 'b', 'c', or 'd'
     created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+    content_hash = db.Column(db.String(64), nullable=True)  # see content_hash_for()
+    # Current QuestionVersion; replaced on edit, and set when the pool is loaded for new questions.
+    version_id = db.Column(db.Integer, nullable=True)
+
+    @staticmethod
+    def content_hash_for(text, option_a, option_b, option_c, option_d, correct):
+        """Hash of the normalized question, independent of option order and case."""
+        def norm(value):
+            return ' '.join(value.split()).casefold()
+        options = [option_a, option_b, option_c, option_d]
+        correct_text = options['abcd'.index(correct)]
+        parts = [norm(text), *sorted(norm(o) for o in options), norm(correct_text)]
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def compute_content_hash(self):
+        return self.content_hash_for(
+            self.text, self.option_a, self.option_b, self.option_c, self.option_d, self.correct,
+        )
 
     def to_dict(self):
         return {
@@ -38,15 +69,179 @@ class Question(db.Model):
         }
 
 
+class QuestionVersion(db.Model):
+    """Immutable snapshot of a question, referenced by compact exam papers.
+
+    Not a foreign key to ``Question``: papers keep their snapshots after the
+    question is edited or deleted.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    question_id = db.Column(db.Integer, nullable=False, index=True)
+    question_set_id = db.Column(db.Integer, nullable=False, index=True)
+    text = db.Column(db.Text, nullable=False)
+    option_a = db.Column(db.String(500), nullable=False)
+    option_b = db.Column(db.String(500), nullable=False)
+    option_c = db.Column(db.String(500), nullable=False)
+    option_d = db.Column(db.String(500), nullable=False)
+    correct = db.Column(db.String(1), nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+
+
 class Exam(db.Model):
+    __table_args__ = (
+        # One exam per student and set; set_login_post's upsert relies on it.
+        # Older databases may hold several, numbered by attempt in upgrade_schema.
+        db.Index('ux_exam_student', 'question_set_id', 'student_email', 'student_index', 'attempt', unique=True),
+        # Results listing, per set and across all sets
+        db.Index('ix_exam_set_finished', 'question_set_id', 'finished_at'),
+        db.Index('ix_exam_finished', 'finished_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     question_set_id = db.Column(db.Integer, db.ForeignKey('question_set.id'), nullable=False)
     student_email = db.Column(db.String(200), nullable=False)
     student_index = db.Column(db.String(50), nullable=False)
+    attempt = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     started_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
     finished_at = db.Column(db.DateTime, nullable=True)
+    regraded_at = db.Column(db.DateTime, nullable=True)
+    save_seq = db.Column(db.Integer, nullable=True)  # sequence number of the latest applied autosave
     score = db.Column(db.Integer, nullable=True)
     total = db.Column(db.Integer, nullable=True)
     passed = db.Column(db.Boolean, nullable=True)
-    questions_data = db.Column(db.Text, nullable=False)  # JSON
-    answers_data = db.Column(db.Text, nullable=True)  # JSON
+    questions_data = db.Column(db.Text, nullable=False)  # JSON paper, see papers.py
+    answers_data = db.Column(db.Text, nullable=True)  # JSON, legacy; answers now live in ExamAnswer
+
+    answers = db.relationship('ExamAnswer', lazy=True, cascade='all, delete-orphan')
+
+
+class ExamAnswer(db.Model):
+    """A student's current choice for one question of an exam."""
+    __table_args__ = (db.UniqueConstraint('exam_id', 'question_id'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    exam_id = db.Column(db.Integer, db.ForeignKey('exam.id'), nullable=False)
+    question_id = db.Column(db.Integer, nullable=False)
+    chosen = db.Column(db.String(1), nullable=False)  # shuffled key shown to the student
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.utcnow())
+
+
+class ArchivedExam(db.Model):
+    """A finished exam moved out of ``Exam`` by ``flask archive-exams``, see archive.py.
+
+    Keeps the exam's id and its summary columns; the paper and answers are one
+    compressed ``payload`` that is only unpacked to show the exam.
+    """
+    __table_args__ = (
+        # set_login_post: an archived exam still counts as the student's attempt
+        db.Index('ix_archived_exam_student', 'question_set_id', 'student_email', 'student_index'),
+        db.Index('ix_archived_exam_set_finished', 'question_set_id', 'finished_at'),
+        db.Index('ix_archived_exam_finished', 'finished_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # the original Exam.id
+    question_set_id = db.Column(db.Integer, nullable=False)
+    student_email = db.Column(db.String(200), nullable=False)
+    student_index = db.Column(db.String(50), nullable=False)
+    attempt = db.Column(db.Integer, nullable=False, default=1)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    regraded_at = db.Column(db.DateTime, nullable=True)
+    score = db.Column(db.Integer, nullable=False)
+    total = db.Column(db.Integer, nullable=False)
+    passed = db.Column(db.Boolean, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.utcnow())
+    payload = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed JSON
+
+
+class ExamPaper(db.Model):
+    """A pre-generated exam paper waiting to be claimed by a student login."""
+    id = db.Column(db.Integer, primary_key=True)
+    question_set_id = db.Column(db.Integer, db.ForeignKey('question_set.id'), nullable=False, index=True)
+    set_version = db.Column(db.Integer, nullable=False)  # QuestionSet.version it was built from
+    questions_data = db.Column(db.Text, nullable=False)  # JSON, same shape as Exam.questions_data
+    created_at = db.Column(db.DateTime, default=lambda: datetime.utcnow())
+
+
+class SetStats(db.Model):
+    """Running totals of a set's graded exams, updated in the grading transaction."""
+    question_set_id = db.Column(db.Integer, db.ForeignKey('question_set.id'), primary_key=True)
+    exams = db.Column(db.Integer, nullable=False, default=0)
+    passed = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    histogram = db.Column(db.Text, nullable=False)  # JSON list of exam counts per 10% score bucket
+
+    def bucket_counts(self):
+        return json.loads(self.histogram)
+
+
+class SchedulerLock(db.Model):
+    """Lease that lets one worker at a time run a periodic background job."""
+    name = db.Column(db.String(50), primary_key=True)
+    owner = db.Column(db.String(100), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+def configure_sqlite(app):
+    """Apply the SQLITE_* pragmas from the config to every new connection."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    pragmas = [
+        ('journal_mode', app.config['SQLITE_JOURNAL_MODE']),
+        ('busy_timeout', app.config['SQLITE_BUSY_TIMEOUT_MS']),
+        ('synchronous', app.config['SQLITE_SYNCHRONOUS']),
+        ('cache_size', app.config['SQLITE_CACHE_SIZE']),
+        ('mmap_size', app.config['SQLITE_MMAP_SIZE']),
+    ]
+
+    @event.listens_for(db.engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            if value not in (None, ''):
+                cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+# Before the unique student index, a student could end up with several exams
+# for a set; number them in start order so the index can be created.
+_NUMBER_ATTEMPTS_SQL = text('''
+    UPDATE exam SET attempt = r.n
+    FROM (
+        SELECT id, row_number() OVER (
+            PARTITION BY question_set_id, student_email, student_index ORDER BY id
+        ) AS n
+        FROM exam
+    ) r
+    WHERE r.id = exam.id AND r.n > 1
+''')
+
+
+def upgrade_schema():
+    """Add columns and indexes that are missing from an older database.
+
+    ``db.create_all()`` only creates missing tables, so existing ``quiz.db``
+    files are brought up to date here. New columns must be nullable or carry
+    a ``server_default``.
+    """
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} ' \
+                      f'{column.type.compile(dialect=db.engine.dialect)}'
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+                conn.execute(text(ddl))
+            if table.name == 'exam' and 'attempt' not in existing:
+                conn.execute(_NUMBER_ATTEMPTS_SQL)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
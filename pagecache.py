@@ -0,0 +1,55 @@
+"""Rendered HTML of pages that can no longer change, cached per worker.
+
+Result pages of finished exams only change on a regrade, which is part of
+their cache key, so a repeat view is served without rendering. Pages are
+stored as encoded bytes, and the cache is bounded by their total size.
+"""
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    """Least recently used rendered pages (bytes), at most ``max_bytes`` in total."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            html = self._pages.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key, html):
+        """Store a page encoded as bytes, so its size is what it takes in memory."""
+        size = len(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._pages[key] = html
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': len(self._pages),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
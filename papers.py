@@ -0,0 +1,225 @@
+"""Compact encoding of exam papers.
+
+Papers used to be a JSON list with a full copy of every question's text and
+options in shuffled order. They now reference immutable ``QuestionVersion``
+snapshots and store only the option order each student sees::
+
+    {"v": 2, "q": [[version_id, "cadb"], [version_id, "bdac", "d"], ...]}
+
+The option shown as ``'abcd'[i]`` is the snapshot's option ``perm[i]``. An
+optional third element replaces the snapshot's correct key; regrades write it.
+``decode_paper`` turns either format into the old list of question dicts, so
+templates and exports do not depend on how an exam was stored.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, Exam, ExamPaper, Question, QuestionSet, QuestionVersion
+
+FORMAT = 2
+KEYS = 'abcd'
+SNAPSHOT_FIELDS = ('question_id', 'text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct')
+
+
+def is_compact(questions_data):
+    return questions_data.startswith('{')
+
+
+def encode_paper(entries):
+    """Serialize ``[version id, perm(, correct key)]`` entries as a compact paper."""
+    return json.dumps({'v': FORMAT, 'q': entries}, ensure_ascii=False, separators=(',', ':'))
+
+
+def _expand(entries, snapshots):
+    questions = []
+    for version_id, perm, *override in entries:
+        qid, text, *options, correct = snapshots[version_id]
+        key = override[0] if override else correct
+        q = {'id': qid, 'text': text}
+        for shown, original in zip(KEYS, perm):
+            q[f'option_{shown}'] = options[KEYS.index(original)]
+        q['correct'] = KEYS[perm.index(key)]
+        questions.append(q)
+    return questions
+
+
+def expand_paper(questions_data, snapshots):
+    """Decode a paper of either format with ``{version id: snapshot tuple}``."""
+    if not is_compact(questions_data):
+        return json.loads(questions_data)
+    return _expand(json.loads(questions_data)['q'], snapshots)
+
+
+def correct_paper(questions_data, corrections, snapshots):
+    """Return the paper with new correct keys, given as ``{question id: shown key}``."""
+    if not is_compact(questions_data):
+        questions = json.loads(questions_data)
+        for q in questions:
+            q['correct'] = corrections.get(q['id'], q['correct'])
+        return json.dumps(questions, ensure_ascii=False)
+    entries = []
+    for version_id, perm, *override in json.loads(questions_data)['q']:
+        snapshot = snapshots[version_id]
+        shown = corrections.get(snapshot[0])
+        if shown is not None:
+            key = perm[KEYS.index(shown)]
+            override = [] if key == snapshot[-1] else [key]
+        entries.append([version_id, perm, *override])
+    return encode_paper(entries)
+
+
+def load_snapshots(*criteria):
+    """Snapshot tuples (``SNAPSHOT_FIELDS``) by version id for the matching versions."""
+    columns = [getattr(QuestionVersion, f) for f in SNAPSHOT_FIELDS]
+    rows = db.session.query(QuestionVersion.id, *columns).filter(*criteria)
+    return {version_id: tuple(snapshot) for version_id, *snapshot in rows}
+
+
+class SnapshotCache:
+    """Least recently used snapshot tuples by version id; snapshots never change."""
+
+    def __init__(self, max_size=50000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, version_ids):
+        found, missing = {}, []
+        with self._lock:
+            for version_id in set(version_ids):
+                snapshot = self._snapshots.get(version_id)
+                if snapshot is None:
+                    missing.append(version_id)
+                else:
+                    self._snapshots.move_to_end(version_id)
+                    found[version_id] = snapshot
+            self.hits += len(found)
+            self.misses += len(missing)
+        for start in range(0, len(missing), 500):
+            loaded = load_snapshots(QuestionVersion.id.in_(missing[start:start + 500]))
+            found.update(loaded)
+            with self._lock:
+                self._snapshots.update(loaded)
+                while len(self._snapshots) > self.max_size:
+                    self._snapshots.popitem(last=False)
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._snapshots), 'hits': self.hits, 'misses': self.misses}
+
+
+snapshots = SnapshotCache()
+
+
+def decode_paper(questions_data):
+    """Decode a paper of either format, loading snapshots through the shared cache."""
+    if not is_compact(questions_data):
+        return json.loads(questions_data)
+    entries = json.loads(questions_data)['q']
+    return _expand(entries, snapshots.get_many(entry[0] for entry in entries))
+
+
+def snapshot_question(question):
+    """Make the question's current content its new version; committed by the caller."""
+    version = QuestionVersion(
+        question_set_id=question.question_set_id,
+        **{f: getattr(question, 'id' if f == 'question_id' else f) for f in SNAPSHOT_FIELDS},
+    )
+    db.session.add(version)
+    db.session.flush()
+    question.version_id = version.id
+
+
+def snapshot_questions(set_id):
+    """Return ``(version ids of a set's questions, number of new snapshots)``.
+
+    Questions without a version are snapshotted. The new snapshots are only
+    flushed; they are committed by the caller, together with the papers that
+    reference them, so a caller that rolls back leaves nothing behind. An
+    edit that raced the snapshot keeps its own newer version.
+    """
+    columns = [getattr(Question, 'id' if f == 'question_id' else f) for f in SNAPSHOT_FIELDS]
+    rows = db.session.query(Question.version_id, *columns).filter(
+        Question.question_set_id == set_id,
+    ).order_by(Question.id).all()
+    new = [row for row in rows if row.version_id is None]
+    if not new:
+        return [row.version_id for row in rows], 0
+    created = db.session.scalars(
+        insert(QuestionVersion).returning(QuestionVersion.id, sort_by_parameter_order=True),
+        [{'question_set_id': set_id, **dict(zip(SNAPSHOT_FIELDS, row[1:]))} for row in new],
+    ).all()
+    question = Question.__table__
+    db.session.execute(
+        update(question)
+        .where(question.c.id == bindparam('qid'), question.c.version_id.is_(None))
+        .values(version_id=bindparam('vid')),
+        [{'qid': row.id, 'vid': version_id} for row, version_id in zip(new, created)],
+    )
+    created = dict(zip((row.id for row in new), created))
+    return [row.version_id or created[row.id] for row in rows], len(created)
+
+
+def _compact_entry(q, set_id, candidates):
+    """Find or create a snapshot matching one full-copy question of an old paper."""
+    for version_id, snapshot in candidates.get(q['id'], ()):
+        if snapshot[1] != q['text']:
+            continue
+        options = snapshot[2:6]
+        shown = [q[f'option_{k}'] for k in KEYS]
+        if sorted(options) == sorted(shown) and len(set(options)) == 4:
+            perm = ''.join(KEYS[options.index(text)] for text in shown)
+            break
+    else:
+        snapshot = (q['id'], q['text'], *(q[f'option_{k}'] for k in KEYS), q['correct'])
+        version = QuestionVersion(question_set_id=set_id, **dict(zip(SNAPSHOT_FIELDS, snapshot)))
+        db.session.add(version)
+        db.session.flush()
+        version_id, perm = version.id, KEYS
+        candidates.setdefault(q['id'], []).append((version_id, snapshot))
+    key = perm[KEYS.index(q['correct'])]
+    return [version_id, perm] if key == snapshot[-1] else [version_id, perm, key]
+
+
+def compact_papers(batch_size=500):
+    """Rewrite full-copy papers of exams and prepared papers in the compact format.
+
+    Each old question copy reuses the question's current snapshot when its text
+    and options still match, and gets a snapshot of its own otherwise. Returns
+    the number of rows converted; every batch is its own transaction.
+    """
+    for (set_id,) in db.session.query(QuestionSet.id).all():
+        snapshot_questions(set_id)
+    db.session.commit()
+    candidates = {}
+    current = load_snapshots(QuestionVersion.id.in_(select(Question.version_id)))
+    for version_id, snapshot in current.items():
+        candidates.setdefault(snapshot[0], []).append((version_id, snapshot))
+
+    converted = 0
+    for model in (Exam, ExamPaper):
+        last_id = 0
+        while True:
+            rows = db.session.query(model.id, model.question_set_id, model.questions_data).filter(
+                model.id > last_id, model.questions_data.startswith('['),
+            ).order_by(model.id).limit(batch_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            updates = [
+                {'id': row.id, 'questions_data': encode_paper([
+                    _compact_entry(q, row.question_set_id, candidates)
+                    for q in json.loads(row.questions_data)
+                ])}
+                for row in rows
+            ]
+            db.session.execute(update(model), updates)
+            db.session.commit()
+            converted += len(updates)
+    return converted
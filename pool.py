@@ -0,0 +1,145 @@
+"""Question pools and pre-generated exam papers.
+
+Starting an exam only needs a random sample of a set's questions, so the
+snapshot version ids of the whole bank are loaded once per worker and reused
+until the set's ``version`` changes. Sets with a paper pool go one step
+further: papers are built ahead of time and a student login just claims one.
+"""
+import logging
+import queue
+import threading
+
+from sqlalchemy import delete, func, insert, select
+
+from models import db, QuestionSet, ExamPaper
+from papers import snapshot_questions
+
+log = logging.getLogger(__name__)
+
+
+class QuestionPoolCache:
+    """Question pools keyed by set id, valid for a single ``QuestionSet.version``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, question_set):
+        """Return the ``QuestionVersion`` ids of the set's questions as a tuple.
+
+        New snapshots are part of the caller's transaction, so a pool that
+        needed any is not cached until a later call finds them committed.
+        """
+        with self._lock:
+            entry = self._pools.get(question_set.id)
+            if entry is not None and entry[0] == question_set.version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        version_ids, created = snapshot_questions(question_set.id)
+        pool = tuple(version_ids)
+        if not created:
+            with self._lock:
+                self._pools[question_set.id] = (question_set.version, pool)
+        return pool
+
+    def discard(self, set_id):
+        with self._lock:
+            self._pools.pop(set_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sets': len(self._pools),
+                'questions': sum(len(p) for _, p in self._pools.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+def claim_paper(question_set):
+    """Atomically take one ready paper for the set's current version.
+
+    Returns its ``questions_data`` or None when the pool is empty. The claim is
+    part of the caller's transaction, so it is undone if the exam insert fails.
+    """
+    next_paper = select(ExamPaper.id).where(
+        ExamPaper.question_set_id == question_set.id,
+        ExamPaper.set_version == question_set.version,
+    ).limit(1).scalar_subquery()
+    return db.session.execute(
+        delete(ExamPaper).where(ExamPaper.id == next_paper).returning(ExamPaper.questions_data),
+    ).scalar()
+
+
+def count_papers(question_set):
+    return db.session.query(func.count(ExamPaper.id)).filter(
+        ExamPaper.question_set_id == question_set.id,
+        ExamPaper.set_version == question_set.version,
+    ).scalar()
+
+
+def fill_papers(question_set, build):
+    """Top the set's pool up to ``paper_pool_size`` and drop stale papers.
+
+    A pool size of 0 empties the pool.
+
+    ``build`` generates the ``questions_data`` of one paper. Returns the number
+    of papers added.
+    """
+    stale = delete(ExamPaper).where(ExamPaper.question_set_id == question_set.id)
+    if question_set.paper_pool_size:
+        stale = stale.where(ExamPaper.set_version != question_set.version)
+    db.session.execute(stale)
+    missing = question_set.paper_pool_size - count_papers(question_set)
+    rows = []
+    for _ in range(max(missing, 0)):
+        questions_data = build(question_set)
+        if questions_data is None:
+            break
+        rows.append({
+            'question_set_id': question_set.id,
+            'set_version': question_set.version,
+            'questions_data': questions_data,
+        })
+    if rows:
+        db.session.execute(insert(ExamPaper), rows)
+    db.session.commit()
+    return len(rows)
+
+
+class PaperRefiller:
+    """Refills paper pools on a background thread so logins never wait for it."""
+
+    def __init__(self, app, build):
+        self.app = app
+        self.build = build
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def request(self, set_id):
+        with self._lock:
+            if set_id in self._pending:
+                return
+            self._pending.add(set_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='paper-refiller', daemon=True)
+                self._thread.start()
+        self._queue.put(set_id)
+
+    def _run(self):
+        while True:
+            set_id = self._queue.get()
+            with self._lock:
+                self._pending.discard(set_id)
+            try:
+                with self.app.app_context():
+                    qs = db.session.get(QuestionSet, set_id)
+                    if qs is not None and qs.paper_pool_size:
+                        fill_papers(qs, self.build)
+            except Exception:
+                log.exception('Refilling paper pool for set %s failed', set_id)
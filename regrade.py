@@ -0,0 +1,176 @@
+"""Regrading of finished exams after a question's correct answer changes.
+
+Every exam's paper pins the question snapshots it was built from, including
+the correct key under that exam's option shuffle. A regrade finds the current
+correct option text among each paper question's options, updates the stored
+key and rescores the exam. Scoring is pure Python over plain data, so large histories
+are fanned out over a process pool.
+"""
+import json
+import multiprocessing
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import exists, func, literal_column, or_, select, update
+
+from models import db, ArchivedExam, Exam, ExamAnswer, Question, QuestionVersion
+from papers import correct_paper, expand_paper, load_snapshots
+from stats import add_deltas, score_bucket
+
+BATCH_SIZE = 500
+
+RegradeDiff = namedtuple(
+    'RegradeDiff',
+    'exam_id email index old_score new_score total old_passed new_passed changed_questions',
+)
+
+
+# Set once per process by _init_rescore: question id -> current correct option
+# text, and the set's question snapshots by version id.
+_correct_texts = {}
+_snapshots = {}
+_pass_threshold = 0.5
+
+
+def _init_rescore(correct_texts, snapshots, pass_threshold):
+    global _correct_texts, _snapshots, _pass_threshold
+    _correct_texts = correct_texts
+    _snapshots = snapshots
+    _pass_threshold = pass_threshold
+
+
+def rescore(task):
+    """Recompute one exam; runs in worker processes, so it only touches plain data.
+
+    ``task`` is (exam_id, questions_data, answers). Returns (exam_id,
+    questions_data or None if unchanged, score, total, passed, changed question
+    count, unmatched question count).
+    """
+    exam_id, questions_data, answers = task
+    correct_texts, pass_threshold = _correct_texts, _pass_threshold
+    questions = expand_paper(questions_data, _snapshots)
+    corrections = {}
+    unmatched = 0
+    for q in questions:
+        correct_text = correct_texts.get(q['id'])
+        if correct_text is None:
+            continue
+        key = next((k for k in 'abcd' if q[f'option_{k}'] == correct_text), None)
+        if key is None:
+            unmatched += 1  # option texts were edited since this exam was taken
+        elif key != q['correct']:
+            q['correct'] = corrections[q['id']] = key
+    score = sum(1 for q in questions if answers.get(str(q['id'])) == q['correct'])
+    total = len(questions)
+    passed = (score / total) >= pass_threshold if total > 0 else False
+    new_data = correct_paper(questions_data, corrections, _snapshots) if corrections else None
+    return exam_id, new_data, score, total, passed, len(corrections), unmatched
+
+
+def _affected_exams(set_id, question_ids):
+    """Finished exams of a set whose paper contains any of the questions."""
+    entries = func.json_each(Exam.questions_data, '$.q').table_valued('value', name='entries')
+    version_ids = select(QuestionVersion.id).where(QuestionVersion.question_id.in_(question_ids))
+    legacy = func.json_each(Exam.questions_data).table_valued('value', name='legacy')
+    on_paper = or_(
+        exists(select(literal_column('1')).select_from(entries).where(
+            func.json_extract(entries.c.value, '$[0]').in_(version_ids),
+        )),
+        # papers stored as full question copies
+        exists(select(literal_column('1')).select_from(legacy).where(
+            func.json_extract(legacy.c.value, '$.id').in_(question_ids),
+        )),
+    )
+    return db.session.query(
+        Exam.id, Exam.question_set_id, Exam.student_email, Exam.student_index,
+        Exam.questions_data, Exam.answers_data, Exam.score, Exam.passed,
+    ).filter(
+        Exam.question_set_id == set_id,
+        Exam.finished_at.isnot(None),
+        on_paper,
+    ).order_by(Exam.id)
+
+
+def regrade(set_id, question_ids=None, dry_run=True, pass_threshold=0.5,
+            workers=1, parallel_min_exams=2000):
+    """Regrade finished exams of a set for some or all of its questions.
+
+    Returns (list of ``RegradeDiff`` for exams whose key or score changed,
+    number of exams checked, number of question copies that could not be
+    matched, number of archived exams of the set that were not checked).
+    Unless ``dry_run``, changes are written one batch per transaction.
+    """
+    query = db.session.query(Question.id, Question.option_a, Question.option_b,
+                             Question.option_c, Question.option_d, Question.correct)
+    query = query.filter(Question.question_set_id == set_id)
+    if question_ids:
+        query = query.filter(Question.id.in_(question_ids))
+    correct_texts = {qid: options['abcd'.index(correct)] for qid, *options, correct in query}
+    # Archived papers are compressed and stay as they were graded
+    archived = db.session.query(func.count(ArchivedExam.id)).filter(
+        ArchivedExam.question_set_id == set_id,
+    ).scalar()
+    if not correct_texts:
+        return [], 0, 0, archived
+
+    query = _affected_exams(set_id, list(correct_texts))
+    checked = query.count()
+    snapshots = load_snapshots(QuestionVersion.question_set_id == set_id)
+    executor = None
+    if workers > 1 and checked >= parallel_min_exams:
+        executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_rescore, initargs=(correct_texts, snapshots, pass_threshold),
+        )
+    else:
+        _init_rescore(correct_texts, snapshots, pass_threshold)
+    diffs = []
+    unmatched_total = 0
+    last_id = 0
+    try:
+        while True:
+            rows = query.filter(Exam.id > last_id).limit(BATCH_SIZE).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            batch = {e.id: e for e in rows}
+            answers = {
+                e.id: json.loads(e.answers_data) if e.answers_data else {} for e in batch.values()
+            }
+            for exam_id, qid, chosen in db.session.query(
+                ExamAnswer.exam_id, ExamAnswer.question_id, ExamAnswer.chosen,
+            ).filter(ExamAnswer.exam_id.in_(batch)):
+                answers[exam_id][str(qid)] = chosen
+            tasks = [(e.id, e.questions_data, answers[e.id]) for e in rows]
+            results = executor.map(rescore, tasks, chunksize=50) if executor else map(rescore, tasks)
+
+            updates = []
+            deltas = {'passed': 0, 'failed': 0, 'score_sum': 0, 'buckets': Counter()}
+            now = datetime.utcnow()
+            for exam_id, new_data, score, total, passed, changed, unmatched in results:
+                unmatched_total += unmatched
+                e = batch[exam_id]
+                if not changed and score == e.score:
+                    continue
+                diffs.append(RegradeDiff(
+                    exam_id, e.student_email, e.student_index, e.score, score, total,
+                    e.passed, passed, changed,
+                ))
+                updates.append({
+                    'id': exam_id, 'questions_data': new_data or e.questions_data,
+                    'score': score, 'total': total, 'passed': passed, 'regraded_at': now,
+                })
+                deltas['passed'] += int(passed) - int(bool(e.passed))
+                deltas['failed'] += int(not passed) - int(not e.passed)
+                deltas['score_sum'] += score - e.score
+                deltas['buckets'][score_bucket(e.score, total)] -= 1
+                deltas['buckets'][score_bucket(score, total)] += 1
+            if updates and not dry_run:
+                db.session.execute(update(Exam), updates)
+                add_deltas(set_id, **deltas)
+                db.session.commit()
+    finally:
+        if executor:
+            executor.shutdown()
+    return diffs, checked, unmatched_total, archived
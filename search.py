@@ -0,0 +1,172 @@
+"""Full-text search and near-duplicate detection over the question bank.
+
+An FTS5 table (``question_fts``) indexes each question's text and options.
+It is an external-content index over ``question`` and is kept in sync by
+triggers, so imports, edits and deletes need no extra code. Near duplicates
+are found by querying the index with the rarest word shingles of each question
+(enough of them that no pair above the threshold is missed) and comparing only
+the candidates it returns, instead of comparing every pair.
+"""
+import math
+import re
+import unicodedata
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from models import db, Question
+
+FTS_COLUMNS = ('text', 'option_a', 'option_b', 'option_c', 'option_d')
+SHINGLE_WORDS = 3
+
+DuplicatePair = namedtuple('DuplicatePair', 'first second similarity')
+
+_WORD = re.compile(r'\w+')
+
+_columns = ', '.join(FTS_COLUMNS)
+_new = ', '.join(f'new.{c}' for c in FTS_COLUMNS)
+_old = ', '.join(f'old.{c}' for c in FTS_COLUMNS)
+_SCHEMA = [
+    f'''CREATE VIRTUAL TABLE question_fts USING fts5(
+        {_columns}, content='question', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )''',
+    # Per-column document counts of every indexed word, used to pick rare probe shingles
+    "CREATE VIRTUAL TABLE IF NOT EXISTS question_fts_vocab USING fts5vocab(question_fts, 'col')",
+    f'''CREATE TRIGGER IF NOT EXISTS question_fts_insert AFTER INSERT ON question BEGIN
+        INSERT INTO question_fts (rowid, {_columns}) VALUES (new.id, {_new});
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS question_fts_delete AFTER DELETE ON question BEGIN
+        INSERT INTO question_fts (question_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS question_fts_update AFTER UPDATE OF {_columns} ON question BEGIN
+        INSERT INTO question_fts (question_fts, rowid, {_columns}) VALUES ('delete', old.id, {_old});
+        INSERT INTO question_fts (rowid, {_columns}) VALUES (new.id, {_new});
+    END''',
+]
+
+# Ids of the questions matching an FTS5 query, used as a subquery.
+_MATCHING_IDS = text('SELECT rowid FROM question_fts WHERE question_fts MATCH :match')
+
+# Later questions of a set whose text contains any of the probe phrases. CROSS
+# JOIN keeps SQLite from scanning the set and probing the index row by row,
+# and the rowid bound lets FTS5 skip the earlier questions.
+_CANDIDATES_SQL = text('''
+    SELECT q.id FROM question_fts f CROSS JOIN question q ON q.id = f.rowid
+    WHERE question_fts MATCH :match AND f.rowid > :question_id AND q.question_set_id = :set_id
+''')
+
+
+def ensure_search_index():
+    """Create the FTS table and its triggers if missing, indexing existing questions."""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'question_fts'"
+        )).first()
+        if not exists:
+            conn.execute(text(_SCHEMA[0]))
+            conn.execute(text("INSERT INTO question_fts (question_fts) VALUES ('rebuild')"))
+        for ddl in _SCHEMA[1:]:
+            conn.execute(text(ddl))
+
+
+def _words(value):
+    return _WORD.findall(value.casefold())
+
+
+def match_query(terms):
+    """FTS5 query matching questions that contain every word of ``terms``.
+
+    The last word also matches as a prefix, so results narrow while typing.
+    Returns None if ``terms`` has no words.
+    """
+    words = _words(terms or '')
+    if not words:
+        return None
+    return ' '.join(f'"{w}"' for w in words[:-1]) + f' "{words[-1]}"*'
+
+
+def search_filter(terms):
+    """A ``Question`` filter for the search ``terms``, or None for no search."""
+    match = match_query(terms)
+    if match is None:
+        return None
+    return Question.id.in_(_MATCHING_IDS.bindparams(match=match).columns(rowid=db.Integer))
+
+
+def shingles(value):
+    """Word ``SHINGLE_WORDS``-grams of the normalized text; short texts are one shingle."""
+    words = _words(value)
+    if len(words) <= SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def _word_counts():
+    """Number of questions whose text contains each indexed word."""
+    rows = db.session.execute(text("SELECT term, doc FROM question_fts_vocab WHERE col = 'text'"))
+    return dict(rows.all())
+
+
+def _index_term(word):
+    """``word`` as the FTS tokenizer indexes it (``remove_diacritics``)."""
+    if word.isascii():
+        return word
+    decomposed = unicodedata.normalize('NFKD', word)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def prefix_size(shingle_count, threshold):
+    """Shingles of a question to probe so that every question at least ``threshold`` similar shares one.
+
+    A pair with Jaccard similarity >= t shares at least ceil(t * n) of the n
+    shingles of either question, so any n - ceil(t * n) + 1 of them contain a
+    shared one.
+    """
+    # The epsilon keeps e.g. 0.6 * 5 = 3.0000000000000004 from rounding up to 4
+    return shingle_count - math.ceil(threshold * shingle_count - 1e-9) + 1
+
+
+def _probe(question_shingles, threshold, word_counts):
+    """FTS5 query for the text column matching the question's rarest ``prefix_size`` shingles.
+
+    A shingle is at most as common as its rarest word; rare probes keep the
+    candidate lists short.
+    """
+    def rarity(shingle):
+        return min(word_counts.get(_index_term(w), 0) for w in shingle.split()), shingle
+
+    count = prefix_size(len(question_shingles), threshold)
+    phrases = sorted(question_shingles, key=rarity)[:count]
+    return 'text : (' + ' OR '.join(f'"{p}"' for p in phrases) + ')'
+
+
+def find_near_duplicates(set_id, threshold=0.6):
+    """Pairs of questions in a set whose texts have a shingle Jaccard similarity >= ``threshold``.
+
+    Each question is compared only with the later questions the index
+    returns for its probe shingles; ``prefix_size`` makes sure these include
+    every pair above the threshold. Returns ``DuplicatePair`` (question ids,
+    first < second) from most to least similar.
+    """
+    texts = dict(db.session.query(Question.id, Question.text).filter(Question.question_set_id == set_id))
+    by_id = {qid: shingles(value) for qid, value in texts.items()}
+    word_counts = _word_counts()
+    pairs = []
+    for qid, own in by_id.items():
+        if not own:
+            continue
+        candidates = db.session.execute(_CANDIDATES_SQL, {
+            'match': _probe(own, threshold, word_counts), 'set_id': set_id, 'question_id': qid,
+        }).scalars()
+        for other_id in candidates:
+            other = by_id.get(other_id)
+            if not other:
+                continue
+            similarity = len(own & other) / len(own | other)
+            if similarity >= threshold:
+                pairs.append(DuplicatePair(qid, other_id, round(similarity, 3)))
+    pairs.sort(key=lambda p: (-p.similarity, p.first, p.second))
+    return pairs
@@ -33,17 +33,107 @@ document.addEventListener('DOMContentLoaded', function () {
         answeredEl.textContent = radios.length;
     }
 
+    updateAnsweredCount();
+
+    // --- Auto-save ---
+    // Only changed answers are sent, shortly after the last change, one request
+    // at a time. Each request carries every answer not yet acknowledged and a
+    // rising sequence number; the server rejects a request older than one it
+    // already applied (409), so a late retry cannot overwrite newer answers.
+    const SAVE_DELAY = 1500;
+    const SAVE_TIMEOUT = 10000;
+    const RETRY_MIN = 1000;
+    const RETRY_MAX = 30000;
+    let seq = SAVE_SEQ;
+    let unsaved = {};  // question id -> chosen key, not yet acknowledged by the server
+    let inFlight = false;
+    let saveTimer = null;
+    let retryDelay = RETRY_MIN;
+    let saving = true;  // false once the server reports the exam as graded
+
+    function hasUnsaved() {
+        return Object.keys(unsaved).length > 0;
+    }
+
+    function savePayload() {
+        const data = new FormData();
+        seq++;
+        data.append('seq', seq);
+        data.append('answered', document.querySelectorAll('.answer-radio:checked').length);
+        Object.keys(unsaved).forEach(function (qid) {
+            data.append('q_' + qid, unsaved[qid]);
+        });
+        return data;
+    }
+
+    function scheduleSave(delay) {
+        clearTimeout(saveTimer);
+        saveTimer = setTimeout(save, delay);
+    }
+
+    function retrySave() {
+        scheduleSave(retryDelay);
+        retryDelay = Math.min(retryDelay * 2, RETRY_MAX);
+    }
+
+    function save() {
+        if (submitted || !saving || inFlight || !hasUnsaved()) return;
+        const sent = Object.assign({}, unsaved);
+        const controller = new AbortController();
+        const timeout = setTimeout(function () { controller.abort(); }, SAVE_TIMEOUT);
+        inFlight = true;
+        fetch(SAVE_URL, { method: 'POST', body: savePayload(), signal: controller.signal })
+            .then(function (response) {
+                return response.json().catch(function () { return {}; }).then(function (body) {
+                    return { status: response.status, body: body };
+                });
+            })
+            .then(function (result) {
+                if (result.status === 200) {
+                    Object.keys(sent).forEach(function (qid) {
+                        if (unsaved[qid] === sent[qid]) delete unsaved[qid];
+                    });
+                    retryDelay = RETRY_MIN;
+                    if (hasUnsaved()) scheduleSave(SAVE_DELAY);
+                } else if (result.status === 409) {
+                    // A newer save (a beacon, or this page in another tab) got there first
+                    seq = Math.max(seq, result.body.seq || 0);
+                    scheduleSave(0);
+                } else if (result.status === 400 || result.status === 401) {
+                    saving = false;
+                } else {
+                    retrySave();
+                }
+            })
+            .catch(retrySave)
+            .finally(function () {
+                clearTimeout(timeout);
+                inFlight = false;
+            });
+    }
+
+    function saveWithBeacon() {
+        if (submitted || !saving || !hasUnsaved() || !navigator.sendBeacon) return;
+        clearTimeout(saveTimer);
+        // Answers stay unsaved until a regular save is acknowledged
+        navigator.sendBeacon(SAVE_URL, savePayload());
+    }
+
     document.querySelectorAll('.answer-radio').forEach(function (radio) {
-        radio.addEventListener('change', updateAnsweredCount);
+        radio.addEventListener('change', function () {
+            updateAnsweredCount();
+            unsaved[radio.name.slice(2)] = radio.value;
+            scheduleSave(SAVE_DELAY);
+        });
     });
-    updateAnsweredCount();
 
-    // --- Auto-save every 30s ---
-    setInterval(function () {
-        if (submitted) return;
-        const formData = new FormData(form);
-        fetch(SAVE_URL, { method: 'POST', body: formData });
-    }, 30000);
+    document.addEventListener('visibilitychange', function () {
+        if (document.visibilityState === 'hidden') {
+            saveWithBeacon();
+        } else if (hasUnsaved()) {
+            scheduleSave(SAVE_DELAY);
+        }
+    });
 
     // --- Auto-submit on time expiry ---
     function autoSubmit() {
@@ -56,6 +146,7 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // --- Confirm before leaving ---
     window.addEventListener('beforeunload', function (e) {
+        saveWithBeacon();
         if (!submitted) {
             e.preventDefault();
             e.returnValue = '';
@@ -0,0 +1,79 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const tbody = document.getElementById('live-exams');
+    const statusEl = document.getElementById('live-status');
+    const RETRY_DELAY = 15000;  // after the server refused the stream (503)
+
+    function cell(text, className) {
+        const td = document.createElement('td');
+        if (className) td.className = className;
+        td.textContent = text;
+        return td;
+    }
+
+    function row(event) {
+        let tr = document.getElementById('exam-' + event.exam);
+        if (!tr) {
+            tr = document.createElement('tr');
+            tr.id = 'exam-' + event.exam;
+            tr.dataset.questions = event.questions || '?';
+            tr.append(
+                cell(event.email), cell(event.index),
+                cell(event.at.slice(11)), cell('0 / ' + tr.dataset.questions, 'answered'),
+                cell('', 'status')
+            );
+            tbody.append(tr);
+        }
+        return tr;
+    }
+
+    function setStatus(tr, label, style) {
+        const badge = document.createElement('span');
+        badge.className = 'badge bg-' + style;
+        badge.textContent = label;
+        tr.querySelector('.status').replaceChildren(badge);
+    }
+
+    function finished(label) {
+        return function (e) {
+            const event = JSON.parse(e.data);
+            const tr = row(event);
+            const link = document.createElement('a');
+            link.href = RESULT_URL.replace(/0$/, event.exam);
+            link.textContent = label + ' ' + event.score + ' / ' + event.total;
+            link.className = 'badge text-decoration-none bg-' + (event.passed ? 'success' : 'danger');
+            tr.querySelector('.status').replaceChildren(link);
+        };
+    }
+
+    function connect() {
+        const source = new EventSource(STREAM_URL);
+
+        source.addEventListener('started', function (e) {
+            setStatus(row(JSON.parse(e.data)), 'In progress', 'primary');
+        });
+
+        source.addEventListener('saved', function (e) {
+            const event = JSON.parse(e.data);
+            const tr = row(event);
+            tr.querySelector('.answered').textContent = event.answered + ' / ' + tr.dataset.questions;
+        });
+
+        source.addEventListener('submitted', finished('Submitted'));
+        source.addEventListener('expired', finished('Time up'));
+
+        source.onopen = function () {
+            statusEl.textContent = 'live';
+            statusEl.className = 'badge bg-success fs-6 align-middle';
+        };
+        source.onerror = function () {
+            statusEl.textContent = 'reconnecting';
+            statusEl.className = 'badge bg-warning fs-6 align-middle';
+            // EventSource gives up on an error response; try again later ourselves
+            if (source.readyState === EventSource.CLOSED) {
+                setTimeout(connect, RETRY_DELAY);
+            }
+        };
+    }
+
+    connect();
+});
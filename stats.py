@@ -0,0 +1,109 @@
+"""Per-set exam statistics kept in ``SetStats``.
+
+``record_grade`` is called from the grading transaction with increments, so
+the dashboard never has to scan ``Exam``. ``rebuild_set_stats`` recomputes
+everything from the graded exams, including archived ones.
+"""
+import json
+
+from sqlalchemy import case, delete, func, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, ArchivedExam, Exam, SetStats
+
+HISTOGRAM_BUCKETS = 11  # 0-9%, 10-19%, ..., 90-99%, 100%
+
+
+def score_bucket(score, total):
+    return min(score * 10 // total, 10) if total else 0
+
+
+def record_grade(set_id, score, total, passed, delta=1):
+    """Add (or with ``delta=-1`` remove) one graded exam; committed by the caller."""
+    add_deltas(
+        set_id,
+        exams=delta,
+        passed=delta if passed else 0,
+        failed=0 if passed else delta,
+        score_sum=score * delta,
+        buckets={score_bucket(score, total): delta},
+    )
+
+
+def add_deltas(set_id, exams=0, passed=0, failed=0, score_sum=0, buckets=None):
+    """Apply aggregated changes to a set's statistics in one statement.
+
+    ``buckets`` maps histogram bucket index to its change. Committed by the
+    caller.
+    """
+    buckets = {b: d for b, d in (buckets or {}).items() if d}
+    histogram = [0] * HISTOGRAM_BUCKETS
+    for b, d in buckets.items():
+        histogram[b] = d
+    updated_histogram = SetStats.histogram
+    if buckets:
+        pairs = []
+        for b, d in sorted(buckets.items()):
+            pairs += [f'$[{b}]', func.json_extract(SetStats.histogram, f'$[{b}]') + d]
+        updated_histogram = func.json_set(SetStats.histogram, *pairs)
+    stmt = sqlite_insert(SetStats).values(
+        question_set_id=set_id,
+        exams=exams,
+        passed=passed,
+        failed=failed,
+        score_sum=score_sum,
+        histogram=json.dumps(histogram),
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['question_set_id'],
+        set_={
+            'exams': SetStats.exams + exams,
+            'passed': SetStats.passed + passed,
+            'failed': SetStats.failed + failed,
+            'score_sum': SetStats.score_sum + score_sum,
+            'histogram': updated_histogram,
+        },
+    )
+    db.session.execute(stmt)
+
+
+def rebuild_set_stats():
+    """Recompute every set's statistics from the graded and archived exams and commit."""
+    histograms = {}
+    totals = {}
+    for model in (Exam, ArchivedExam):
+        finished = model.finished_at.isnot(None)
+        bucket = case(
+            (model.total > 0, func.min(model.score * 10 // model.total, 10)),
+            else_=0,
+        )
+        for set_id, b, n in db.session.query(model.question_set_id, bucket, func.count()).filter(
+            finished,
+        ).group_by(model.question_set_id, bucket):
+            histograms.setdefault(set_id, [0] * HISTOGRAM_BUCKETS)[b] += n
+        for set_id, exams, passed, score_sum in db.session.query(
+            model.question_set_id,
+            func.count(),
+            func.sum(case((model.passed.is_(True), 1), else_=0)),
+            func.sum(model.score),
+        ).filter(finished).group_by(model.question_set_id):
+            total = totals.setdefault(set_id, [0, 0, 0])
+            total[0] += exams
+            total[1] += passed or 0
+            total[2] += score_sum or 0
+    rows = [
+        {
+            'question_set_id': set_id,
+            'exams': exams,
+            'passed': passed,
+            'failed': exams - passed,
+            'score_sum': score_sum,
+            'histogram': json.dumps(histograms.get(set_id, [0] * HISTOGRAM_BUCKETS)),
+        }
+        for set_id, (exams, passed, score_sum) in totals.items()
+    ]
+    db.session.execute(delete(SetStats))
+    if rows:
+        db.session.execute(insert(SetStats), rows)
+    db.session.commit()
+    return len(rows)
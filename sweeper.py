@@ -0,0 +1,125 @@
+"""Background grading of exams whose time ran out.
+
+Students who close the tab never trigger the lazy grading in the exam routes,
+so every worker runs a sweeper thread. A lease row in ``scheduler_lock`` makes
+sure only one of them sweeps at a time.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import db, Exam, SchedulerLock
+
+log = logging.getLogger(__name__)
+
+LOCK_NAME = 'deadline-sweeper'
+
+
+def acquire_lease(name, owner, ttl_seconds):
+    """Take or renew the named lease; returns True if ``owner`` holds it now."""
+    now = datetime.utcnow()
+    db.session.execute(
+        sqlite_insert(SchedulerLock)
+        .values(name=name, owner=owner, expires_at=now)
+        .on_conflict_do_nothing(index_elements=['name'])
+    )
+    taken = db.session.execute(
+        update(SchedulerLock)
+        .where(
+            SchedulerLock.name == name,
+            (SchedulerLock.owner == owner) | (SchedulerLock.expires_at <= now),
+        )
+        .values(owner=owner, expires_at=now + timedelta(seconds=ttl_seconds))
+    ).rowcount
+    db.session.commit()
+    return taken == 1
+
+
+def sweep_expired(grade, duration_minutes, batch_size=100, grace=timedelta(0)):
+    """Grade every unfinished exam past its deadline plus ``grace``, one transaction per batch.
+
+    ``grade(exam, commit=False)`` grades a single exam and returns a function
+    to call once the grade is committed, or None if the exam was already
+    graded. Each exam is graded in a savepoint, so an exam that fails is
+    logged and skipped instead of rolling back (and forever blocking) the
+    batch. Returns the number of exams this call graded.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=duration_minutes) - grace
+    graded = 0
+    last_id = 0
+    while True:
+        exams = Exam.query.filter(
+            Exam.id > last_id,
+            Exam.finished_at.is_(None),
+            Exam.started_at < cutoff,
+        ).order_by(Exam.id).limit(batch_size).all()
+        if not exams:
+            return graded
+        last_id = exams[-1].id
+        # pysqlite only begins a transaction before its first write, and a
+        # savepoint outside one would commit on release
+        db.session.execute(text('BEGIN IMMEDIATE'))
+        done = []
+        for exam in exams:
+            try:
+                with db.session.begin_nested():
+                    committed = grade(exam, commit=False)
+            except Exception:
+                log.exception('Grading expired exam %d failed, skipped', exam.id)
+                continue
+            if committed is not None:
+                done.append(committed)
+        db.session.commit()
+        for committed in done:
+            committed()
+        graded += len(done)
+
+
+class DeadlineSweeper:
+    """Periodically sweeps expired exams while this worker holds the lease."""
+
+    def __init__(self, app, grade, grace=timedelta(0)):
+        self.app = app
+        self.grade = grade
+        self.grace = grace
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._lock = threading.Lock()
+        self._thread = None
+        self.sweeps = 0
+        self.graded = 0
+
+    def start(self):
+        interval = self.app.config['DEADLINE_SWEEP_SECONDS']
+        if not interval or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, args=(interval,), name='deadline-sweeper', daemon=True,
+                )
+                self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                with self.app.app_context():
+                    if acquire_lease(LOCK_NAME, self.owner, ttl_seconds=3 * interval):
+                        self.graded += sweep_expired(
+                            self.grade,
+                            self.app.config['EXAM_DURATION_MINUTES'],
+                            self.app.config['DEADLINE_SWEEP_BATCH'],
+                            self.grace,
+                        )
+                        self.sweeps += 1
+            except Exception:
+                log.exception('Deadline sweep failed')
+
+    def stats(self):
+        return {'sweeps': self.sweeps, 'graded': self.graded}
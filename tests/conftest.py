@@ -0,0 +1,91 @@
+"""Shared fixtures. The app reads its configuration once, at import, so the
+test database and settings are set up in the environment before ``app`` is
+imported and every test starts from empty tables."""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_db_dir = tempfile.mkdtemp(prefix='quiz-machine-tests-')
+os.environ.update({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_db_dir, 'quiz.db'),
+    'SECRET_KEY': 'test',
+    'TEACHER_PASSWORD': 'teacher',
+    'DEADLINE_SWEEP_SECONDS': '0',
+    'AUTOSAVE_WRITE_BEHIND': '0',
+    'METRICS_ENABLED': '0',
+    'LIVE_EVENTS_FILE': '',
+    'EXAM_QUESTION_COUNT': '5',
+})
+sys.path.insert(0, ROOT)
+
+import app as quiz  # noqa: E402
+from examstate import ExamStateCache  # noqa: E402
+from models import db, Exam, QuestionSet, Question  # noqa: E402
+from pagecache import PageCache  # noqa: E402
+from pool import QuestionPoolCache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def app(monkeypatch):
+    # Fresh per-worker caches: ids are reused once the tables are emptied
+    monkeypatch.setattr(quiz, 'question_pool', QuestionPoolCache())
+    monkeypatch.setattr(quiz, 'exam_states', ExamStateCache(100))
+    monkeypatch.setattr(quiz, 'result_pages', PageCache(1024 * 1024))
+    quiz.app.config['TESTING'] = True
+    with quiz.app.app_context():
+        yield quiz.app
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def question_set():
+    """A set of 5 questions whose correct answer is always option a."""
+    qs = QuestionSet(name='Test set')
+    db.session.add(qs)
+    db.session.flush()
+    for i in range(5):
+        db.session.add(Question(
+            question_set_id=qs.id, text=f'Question {i}?', option_a=f'right {i}',
+            option_b=f'wrong {i}b', option_c=f'wrong {i}c', option_d=f'wrong {i}d', correct='a',
+        ))
+    db.session.commit()
+    return qs
+
+
+def login(client, question_set, email='ala@example.com', index='123456'):
+    return client.post(f'/q/{question_set.uuid}/login', data={'email': email, 'index': index})
+
+
+@pytest.fixture
+def teacher(app):
+    client = app.test_client()
+    client.post('/teacher/login', data={'password': 'teacher'})
+    return client
+
+
+def paper(exam_id):
+    """Question dicts of an exam's paper, as shown to the student."""
+    return quiz.exam_states.get(exam_id).questions
+
+
+def take_exam(question_set, index, right):
+    """Log a student in, answer ``right`` questions correctly and the rest wrong, submit."""
+    client = quiz.app.test_client()
+    login(client, question_set, email=f'student{index}@example.com', index=str(index))
+    exam = Exam.query.filter_by(student_index=str(index)).one()
+    answers = {}
+    for i, q in enumerate(paper(exam.id)):
+        answers[f'q_{q["id"]}'] = q['correct'] if i < right else next(k for k in 'abcd' if k != q['correct'])
+    client.post('/exam/submit', data=answers)
+    return client, exam.id
@@ -0,0 +1,45 @@
+import json
+
+from analytics import ItemAnalysisCache, _SetMatrix
+from conftest import take_exam
+from models import db, Exam, ExamAnswer
+
+
+def _analyse(question_set):
+    return ItemAnalysisCache().analyse(question_set)
+
+
+def test_scores_match_the_graded_exams(question_set):
+    for i, right in enumerate((5, 3, 0)):
+        take_exam(question_set, i, right)
+
+    items = _analyse(question_set)
+
+    assert [item['exams'] for item in items] == [3] * 5
+    assert sum(round(item['difficulty'] * item['exams']) for item in items) == 8
+    assert all(item['picks']['a'] == item['difficulty'] for item in items)
+    assert all(item['unanswered'] == 0 for item in items)
+
+
+def test_set_query_matches_the_per_exam_read(question_set, monkeypatch):
+    for i, right in enumerate((5, 4, 2, 1)):
+        take_exam(question_set, i, right)
+    fast = _analyse(question_set)
+
+    monkeypatch.setattr(_SetMatrix, '_read', _SetMatrix._read_legacy)
+
+    assert _analyse(question_set) == fast
+
+
+def test_exams_with_legacy_answers_are_included(question_set):
+    for i, right in enumerate((5, 2)):
+        take_exam(question_set, i, right)
+    before = _analyse(question_set)
+    exam = Exam.query.order_by(Exam.id).first()
+    answers = ExamAnswer.query.filter_by(exam_id=exam.id).all()
+    exam.answers_data = json.dumps({str(a.question_id): a.chosen for a in answers})
+    for answer in answers:
+        db.session.delete(answer)
+    db.session.commit()
+
+    assert _analyse(question_set) == before
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+from archive import archive_exams, pack_exam, unpack_exam
+from conftest import login, quiz, take_exam
+from models import db, ArchivedExam, Exam, ExamAnswer
+from pagecache import PageCache
+
+
+def test_pack_round_trip():
+    questions_data = '{"v":1,"q":[[7,"cabd"],[9,"abcd","b"]]}'
+    answers = {'3': 'a', '5': 'd'}
+
+    assert unpack_exam(pack_exam(questions_data, answers)) == (questions_data, answers)
+
+
+def test_archived_exams_look_the_same(question_set, teacher, monkeypatch):
+    students = [take_exam(question_set, i, right) for i, right in enumerate((5, 3, 0))]
+
+    def pages():
+        monkeypatch.setattr(quiz, 'result_pages', PageCache(1024 * 1024))
+        return [
+            *(client.get(f'/result/{exam_id}').data for client, exam_id in students),
+            *(teacher.get(f'/teacher/results/{exam_id}').data for _, exam_id in students),
+            b''.join(teacher.get('/teacher/results/csv').response),
+            b''.join(teacher.get('/teacher/results/answers.csv').response),
+        ]
+
+    before = pages()
+    assert archive_exams(set_id=question_set.id)[0] == 3
+    assert Exam.query.count() == 0 and ExamAnswer.query.count() == 0
+    assert ArchivedExam.query.count() == 3
+
+    assert pages() == before
+    assert [e.score for e in ArchivedExam.query.order_by(ArchivedExam.id)] == [5, 3, 0]
+
+
+def test_archive_by_date_keeps_newer_exams(question_set):
+    _, old_id = take_exam(question_set, 1, 5)
+    _, new_id = take_exam(question_set, 2, 5)
+    db.session.get(Exam, old_id).finished_at = datetime.utcnow() - timedelta(days=400)
+    db.session.commit()
+
+    assert archive_exams(finished_before=datetime.utcnow() - timedelta(days=365))[0] == 1
+
+    assert [e.id for e in ArchivedExam.query] == [old_id]
+    assert [e.id for e in Exam.query] == [new_id]
+
+
+def test_archived_exam_still_counts_as_the_attempt(question_set):
+    _, exam_id = take_exam(question_set, 1, 5)
+    archive_exams(set_id=question_set.id)
+
+    response = login(quiz.app.test_client(), question_set, email='student1@example.com', index='1')
+
+    assert response.headers['Location'].endswith(f'/result/{exam_id}')
+    assert Exam.query.count() == 0
+
+
+def test_new_exams_do_not_reuse_archived_ids(question_set):
+    _, archived_id = take_exam(question_set, 1, 5)
+    archive_exams(set_id=question_set.id)
+
+    take_exam(question_set, 2, 5)
+
+    assert Exam.query.one().id > archived_id
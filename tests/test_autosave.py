@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+
+from autosave import AnswerBuffer
+from conftest import login, paper, quiz
+from models import db, Exam, ExamAnswer
+
+
+def _answers(exam_id):
+    return dict(db.session.query(ExamAnswer.question_id, ExamAnswer.chosen).filter_by(exam_id=exam_id))
+
+
+def _save(client, seq, answers):
+    data = {f'q_{qid}': key for qid, key in answers.items()}
+    return client.post('/exam/save', data={'seq': seq, 'answered': len(answers), **data})
+
+
+def test_save_writes_only_the_posted_answers(client, question_set):
+    login(client, question_set)
+    exam = Exam.query.one()
+    first, second = (q['id'] for q in paper(exam.id)[:2])
+
+    assert _save(client, 1, {first: 'a'}).status_code == 200
+    assert _save(client, 2, {second: 'b'}).status_code == 200
+
+    assert _answers(exam.id) == {first: 'a', second: 'b'}
+    assert db.session.get(Exam, exam.id).save_seq == 2
+
+
+def test_stale_save_is_rejected_with_the_current_seq(client, question_set):
+    login(client, question_set)
+    exam = Exam.query.one()
+    qid = paper(exam.id)[0]['id']
+
+    assert _save(client, 5, {qid: 'c'}).status_code == 200
+    response = _save(client, 4, {qid: 'a'})
+
+    assert response.status_code == 409
+    assert response.get_json() == {'ok': False, 'seq': 5}
+    assert _answers(exam.id) == {qid: 'c'}
+
+
+def test_save_after_grading_is_rejected(client, question_set):
+    login(client, question_set)
+    exam = Exam.query.one()
+    qid = paper(exam.id)[0]['id']
+    quiz._grade_exam(exam)
+
+    assert _save(client, 1, {qid: 'a'}).status_code == 400
+    assert _answers(exam.id) == {}
+
+
+def test_buffered_stale_save_is_rejected(client, question_set, monkeypatch):
+    buffer = AnswerBuffer(quiz.app, quiz._upsert_answers, interval=5, max_staleness=15)
+    monkeypatch.setattr(quiz, 'answer_buffer', buffer)
+    login(client, question_set)
+    exam = Exam.query.one()
+    qid = paper(exam.id)[0]['id']
+
+    assert _save(client, 2, {qid: 'b'}).status_code == 200
+    assert _save(client, 1, {qid: 'a'}).status_code == 409
+    assert buffer.pending(exam.id) == {str(qid): 'b'}
+
+    buffer.flush()
+    assert _answers(exam.id) == {qid: 'b'}
+
+
+def test_buffered_answers_reach_a_grade_made_by_another_worker(client, question_set, monkeypatch):
+    # This worker's buffer holds the answers; the sweeper runs "elsewhere" with an empty one
+    buffer = AnswerBuffer(quiz.app, quiz._upsert_answers, interval=5, max_staleness=15)
+    monkeypatch.setattr(quiz, 'answer_buffer', buffer)
+    monkeypatch.setattr(quiz, 'GRADE_GRACE', timedelta(seconds=buffer.grace_seconds))
+    login(client, question_set)
+    exam = Exam.query.one()
+    questions = paper(exam.id)
+    assert _save(client, 1, {q['id']: q['correct'] for q in questions}).status_code == 200
+
+    # Just past the deadline: no more saves, and not graded yet
+    duration = timedelta(minutes=quiz.app.config['EXAM_DURATION_MINUTES'])
+    exam.started_at = datetime.utcnow() - duration - timedelta(seconds=1)
+    db.session.commit()
+    quiz.exam_states.discard(exam.id)
+    assert _save(client, 2, {questions[0]['id']: 'a'}).status_code == 400
+    assert quiz.sweep_expired(quiz._grade_exam, quiz.app.config['EXAM_DURATION_MINUTES'],
+                              grace=quiz.GRADE_GRACE) == 0
+
+    buffer.flush()
+    exam.started_at -= timedelta(seconds=buffer.grace_seconds)
+    db.session.commit()
+    monkeypatch.setattr(quiz, 'answer_buffer', AnswerBuffer(quiz.app, quiz._upsert_answers, 5, 15))
+    assert quiz.sweep_expired(quiz._grade_exam, quiz.app.config['EXAM_DURATION_MINUTES'],
+                              grace=quiz.GRADE_GRACE) == 1
+    assert db.session.get(Exam, exam.id).score == len(questions)
+
+    buffer.flush()
+    assert buffer.save_seq(exam.id) == 0  # forgotten once graded elsewhere
@@ -0,0 +1,93 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login, quiz
+from models import db, Exam, QuestionVersion
+
+
+def test_login_creates_one_exam_with_a_paper(client, question_set):
+    response = login(client, question_set)
+
+    assert response.headers['Location'].endswith('/exam')
+    exam = Exam.query.one()
+    assert exam.attempt == 1
+    assert len(quiz.exam_states.get(exam.id).questions) == 5
+
+
+def test_second_login_resumes_the_same_exam(client, question_set):
+    login(client, question_set)
+    exam = Exam.query.one()
+    questions_data = exam.questions_data
+
+    response = login(quiz.app.test_client(), question_set)
+
+    assert response.headers['Location'].endswith('/exam')
+    assert Exam.query.count() == 1
+    assert db.session.get(Exam, exam.id).questions_data == questions_data
+
+
+def test_concurrent_logins_create_a_single_exam(question_set):
+    uuid = question_set.uuid
+    barrier = threading.Barrier(8)
+    locations, errors = [], []
+
+    def attempt():
+        try:
+            client = quiz.app.test_client()
+            barrier.wait()
+            response = client.post(f'/q/{uuid}/login', data={'email': 'ala@example.com', 'index': '123456'})
+            locations.append(response.headers['Location'])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=attempt) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert all(location.endswith('/exam') for location in locations)
+    assert Exam.query.count() == 1
+    assert Exam.query.one().questions_data
+
+
+def test_login_after_finishing_shows_the_result(client, question_set):
+    login(client, question_set)
+    client.post('/exam/submit')
+    exam = Exam.query.one()
+
+    response = login(quiz.app.test_client(), question_set)
+
+    assert response.headers['Location'].endswith(f'/result/{exam.id}')
+    assert Exam.query.count() == 1
+
+
+def test_login_after_the_deadline_grades_the_exam(client, question_set):
+    login(client, question_set)
+    exam = Exam.query.one()
+    exam.started_at = datetime.utcnow() - timedelta(minutes=quiz.app.config['EXAM_DURATION_MINUTES'] + 1)
+    db.session.commit()
+
+    response = login(quiz.app.test_client(), question_set)
+
+    assert response.headers['Location'].endswith(f'/result/{exam.id}')
+    assert db.session.get(Exam, exam.id).finished_at is not None
+    assert Exam.query.count() == 1
+
+
+def test_failed_login_leaves_no_exam_or_snapshots(client, question_set, monkeypatch):
+    def fail(entries):
+        raise RuntimeError('paper failed')
+
+    # The set's questions are snapshotted by this login, before the paper fails
+    monkeypatch.setattr(quiz, 'encode_paper', fail)
+    with pytest.raises(RuntimeError):
+        login(client, question_set)
+    db.session.rollback()
+
+    assert Exam.query.count() == 0
+    assert QuestionVersion.query.count() == 0
+    assert quiz.question_pool.stats()['sets'] == 0
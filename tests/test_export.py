@@ -0,0 +1,110 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import export
+from archive import archive_exams
+from conftest import login, quiz, take_exam
+from export import export_responses, load_responses
+from models import db, Exam, Question
+from regrade import regrade
+
+
+def _column(directory, name):
+    _, _, parts = load_responses(directory)
+    return np.concatenate([part[name] for part in parts])
+
+
+def test_export_matches_the_stored_scores(question_set, tmp_path):
+    scores = {take_exam(question_set, i, right)[1]: right for i, right in enumerate((5, 2, 0))}
+
+    assert export_responses(str(tmp_path)) == (3, 15)
+
+    exam_ids = _column(tmp_path, 'exam_id')
+    is_correct = _column(tmp_path, 'is_correct')
+    assert {exam_id: int(is_correct[exam_ids == exam_id].sum()) for exam_id in scores} == scores
+    assert (_column(tmp_path, 'chosen') >= 0).all()
+
+
+def test_later_runs_only_append_new_exams(question_set, tmp_path):
+    take_exam(question_set, 1, 5)
+    export_responses(str(tmp_path))
+
+    assert export_responses(str(tmp_path)) == (0, 0)
+    take_exam(question_set, 2, 3)
+    assert export_responses(str(tmp_path)) == (1, 5)
+
+    manifest, students, parts = load_responses(str(tmp_path))
+    assert [part['rows'] for part in manifest['parts']] == [5, 5]
+    assert manifest['rows'] == 10
+    assert students == [['student1@example.com', '1'], ['student2@example.com', '2']]
+
+
+def test_export_stops_before_the_oldest_running_exam(question_set, tmp_path):
+    login(quiz.app.test_client(), question_set, email='slow@example.com', index='0')
+    running = Exam.query.one()
+    _, finished_id = take_exam(question_set, 1, 5)
+
+    assert export_responses(str(tmp_path)) == (0, 0)
+
+    quiz._grade_exam(running)
+    assert export_responses(str(tmp_path)) == (2, 10)
+    assert sorted(set(_column(tmp_path, 'exam_id').tolist())) == [running.id, finished_id]
+
+
+def test_row_count_spans_several_parts(question_set, tmp_path, monkeypatch):
+    monkeypatch.setattr(export, 'PART_ROWS', 4)
+    for i in range(2):
+        take_exam(question_set, i, 5)
+
+    assert export_responses(str(tmp_path)) == (2, 10)
+
+    manifest, _, _ = load_responses(str(tmp_path))
+    assert [part['rows'] for part in manifest['parts']] == [4, 4, 2]
+    assert manifest['rows'] == 10
+
+
+def test_live_and_archived_exams_are_exported_in_id_order(question_set, tmp_path):
+    ids = [take_exam(question_set, i, 5)[1] for i in range(3)]
+    db.session.get(Exam, ids[1]).finished_at = datetime.utcnow() - timedelta(days=400)
+    db.session.commit()
+    archive_exams(finished_before=datetime.utcnow() - timedelta(days=365))
+
+    assert export_responses(str(tmp_path)) == (3, 15)
+
+    exam_ids = _column(tmp_path, 'exam_id')
+    assert (np.diff(exam_ids) >= 0).all()
+    assert sorted(set(exam_ids.tolist())) == ids
+
+
+def test_full_export_starts_over(question_set, tmp_path):
+    take_exam(question_set, 1, 5)
+    export_responses(str(tmp_path))
+    take_exam(question_set, 2, 5)
+    export_responses(str(tmp_path))
+
+    assert export_responses(str(tmp_path), full=True) == (2, 10)
+
+    manifest, _, _ = load_responses(str(tmp_path))
+    assert len(manifest['parts']) == 1
+
+
+def test_regraded_exams_replace_their_exported_rows(question_set, tmp_path):
+    ids = [take_exam(question_set, i, right)[1] for i, right in enumerate((5, 0, 3))]
+    export_responses(str(tmp_path))
+    question = Question.query.order_by(Question.id).first()
+    question.correct = 'b'
+    db.session.commit()
+    diffs = regrade(question_set.id, question_ids=[question.id], dry_run=False)[0]
+    assert diffs
+
+    assert export_responses(str(tmp_path)) == (3, 15)
+
+    manifest, _, parts = load_responses(str(tmp_path))
+    assert manifest['parts'][-1]['supersedes'] == ids
+    assert manifest['rows'] == sum(len(part['exam_id']) for part in parts) == 15
+    exam_ids = _column(tmp_path, 'exam_id')
+    is_correct = _column(tmp_path, 'is_correct')
+    scores = {e.id: e.score for e in Exam.query}
+    assert {exam_id: int(is_correct[exam_ids == exam_id].sum()) for exam_id in ids} == scores
+    assert export_responses(str(tmp_path)) == (0, 0)
@@ -0,0 +1,42 @@
+from models import db, Question
+from search import find_near_duplicates, prefix_size, shingles
+
+WORDS = [f'w{i}' for i in range(30)]
+
+
+def _question(question_set, value):
+    question = Question(
+        question_set_id=question_set.id, text=value, option_a='a', option_b='b',
+        option_c='c', option_d='d', correct='a',
+    )
+    db.session.add(question)
+    db.session.commit()
+    return question.id
+
+
+def test_prefix_size_guarantees_a_shared_shingle():
+    assert prefix_size(5, 0.6) == 3
+    assert prefix_size(28, 0.6) == 12
+    assert prefix_size(1, 0.6) == 1
+
+
+def test_finds_a_pair_differing_in_its_longest_words(question_set):
+    first, second = list(WORDS), list(WORDS)
+    first[10], first[20] = 'photosynthesis', 'chlorophyllous'
+    second[10], second[20] = 'mitochondrion', 'endoplasmic'
+    first_id = _question(question_set, ' '.join(first))
+    second_id = _question(question_set, ' '.join(second))
+    own, other = shingles(' '.join(first)), shingles(' '.join(second))
+    similarity = len(own & other) / len(own | other)
+    assert similarity >= 0.6
+
+    pairs = find_near_duplicates(question_set.id)
+
+    assert [(p.first, p.second, p.similarity) for p in pairs] == [(first_id, second_id, round(similarity, 3))]
+
+
+def test_finds_pairs_whatever_the_insertion_order(question_set):
+    shared = ' '.join(WORDS)
+    ids = [_question(question_set, shared + ' alpha beta'), _question(question_set, 'gamma delta ' + shared)]
+
+    assert [(p.first, p.second) for p in find_near_duplicates(question_set.id)] == [tuple(ids)]